@@ -0,0 +1,173 @@
+"""Remembers the analysis of posts whose text has not changed."""
+
+import hashlib
+import json
+from time import time
+from src.Recipe import RefinedPost
+
+MAX_ENTRIES = 500000
+FLUSH_SIZE = 200
+QUERY_CHUNK_SIZE = 500
+
+
+class AnalysisCache:
+    """
+    Cache of Analyzer.analyze results stored in the recipe database, keyed
+    by a hash of the analyzer version and the normalized text of the post.
+
+    Revisited, backfilled or reprocessed posts skip the analysis entirely.
+    The least recently used entries are evicted once there are more than
+    max_entries of them.
+    """
+
+    def __init__(self, db, version, max_entries=MAX_ENTRIES,
+                 flush_size=FLUSH_SIZE):
+        """
+        :param db: The Database to store the results in.
+        :param version: The analysis version, as from
+        Analyzer.get_analysis_version. Changing it makes every cached result
+        stale.
+        :param max_entries: How many results to keep.
+        :param flush_size: How many new results or hits are kept before
+        writing them.
+        """
+
+        self.connection = db.connection
+        self.cursor = self.connection.cursor()
+        self.version = version
+        self.max_entries = max_entries
+        self.flush_size = flush_size
+        self.pending_rows = {}
+        self.pending_hits = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = self.cursor.execute(
+            'SELECT COUNT(*) FROM AnalysisCache').fetchone()[0]
+
+    def get_key(self, raw_post):
+        """
+        Hashes the analyzer version with the title and content of a post.
+        Line endings and trailing whitespace do not change the key.
+
+        :param raw_post: The RawPost to hash.
+        :return: The hex digest.
+        """
+
+        content = '\n'.join(line.rstrip() for line in
+                            raw_post.content.replace('\r\n', '\n').split('\n'))
+        text = '\0'.join((str(self.version), raw_post.title.strip(),
+                          content.strip()))
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def get_many(self, raw_posts):
+        """Looks up the cached results of several posts at once.
+
+        :param raw_posts: The RawPosts to look up.
+        :return: A list of (found, refined_post) tuples in the same order
+        as the posts. refined_post is None for posts that are no recipe.
+        """
+
+        keys = [self.get_key(raw_post) for raw_post in raw_posts]
+        found = {}
+
+        unique_keys = list(set(keys))
+        for start in range(0, len(unique_keys), QUERY_CHUNK_SIZE):
+            chunk = unique_keys[start:start + QUERY_CHUNK_SIZE]
+            sql = 'SELECT key, is_recipe, title, ingredients, instructions ' \
+                  'FROM AnalysisCache WHERE key IN ({0})'.format(
+                      ', '.join('?' * len(chunk)))
+            for row in self.cursor.execute(sql, chunk):
+                found[row[0]] = self.row_to_result(row)
+
+        results = []
+        for key in keys:
+            if key in self.pending_rows:
+                found[key] = self.row_to_result(self.pending_rows[key])
+            if key in found:
+                self.hits += 1
+                self.pending_hits.add(key)
+                results.append((True, found[key]))
+            else:
+                self.misses += 1
+                results.append((False, None))
+
+        self.manage_queue()
+        return results
+
+    def row_to_result(self, row):
+        """Rebuilds an analysis result from a cached row.
+
+        :param row: The key, is_recipe, title, ingredients and instructions.
+        :return: The RefinedPost without a type, or None if no recipe.
+        """
+
+        if not row[1]:
+            return None
+        return RefinedPost(row[2], json.loads(row[3]), json.loads(row[4]),
+                           None)
+
+    def put(self, raw_post, refined_post):
+        """Caches the analysis result of a post.
+
+        :param raw_post: The RawPost that was analyzed.
+        :param refined_post: The RefinedPost found, or None if no recipe.
+        """
+
+        key = self.get_key(raw_post)
+        if refined_post is None:
+            row = (key, 0, None, None, None)
+        else:
+            row = (key, 1, refined_post.title,
+                   json.dumps(list(refined_post.ingredients)),
+                   json.dumps(list(refined_post.instructions)))
+        self.pending_rows[key] = row
+        self.manage_queue()
+
+    def manage_queue(self):
+        """Writes the pending results and hits once there are enough."""
+
+        if len(self.pending_rows) + len(self.pending_hits) >= \
+                self.flush_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the pending results, marks the hit entries as recently used,
+        and evicts the least recently used entries if there are too many.
+        """
+
+        if not self.pending_rows and not self.pending_hits:
+            return
+
+        now = int(time())
+        with self.connection:
+            self.cursor.executemany(
+                'INSERT OR IGNORE INTO AnalysisCache VALUES(?, ?, ?, ?, ?, ?)',
+                [row + (now,) for row in self.pending_rows.values()])
+            self.size += self.cursor.rowcount
+            self.cursor.executemany(
+                'UPDATE AnalysisCache SET last_used = ? WHERE key = ?',
+                [(now, key) for key in self.pending_hits])
+
+            if self.size > self.max_entries:
+                self.cursor.execute(
+                    'DELETE FROM AnalysisCache WHERE key IN ('
+                    'SELECT key FROM AnalysisCache ORDER BY last_used '
+                    'LIMIT ?)', [self.size - self.max_entries])
+                self.evictions += self.cursor.rowcount
+                self.size -= self.cursor.rowcount
+
+        self.pending_rows = {}
+        self.pending_hits = set()
+
+    def get_hit_rate(self):
+        """The share of lookups that were answered from the cache."""
+
+        return self.hits / max(self.hits + self.misses, 1)
+
+    def __str__(self):
+        return '{0} hits, {1} misses ({2:.1%} hit rate), {3} entries, ' \
+               '{4} evicted'.format(self.hits, self.misses,
+                                    self.get_hit_rate(), self.size,
+                                    self.evictions)
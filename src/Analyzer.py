@@ -2,21 +2,233 @@
 Analyzes submissions and posts that are deemed "recipes".
 """
 
-from praw import objects
-from fuzzywuzzy import fuzz
-import string
+import hashlib
+import os
 import re
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+from src.KeywordMatcher import KeywordMatcher
+from src.Metrics import metrics
+from src.Recipe import RefinedPost, ParsedPost
+from src.TitleIndex import load_title_index, get_cache_header
+import string
+
+MISC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                        'misc')
+TITLES_PATH = os.path.join(MISC_DIR, 'recipe_titles.txt')
+TITLES_CACHE_PATH = os.path.join(MISC_DIR, 'recipe_titles.cache')
+
+# How many posts are sent to a worker process at a time.
+ANALYSIS_CHUNK_SIZE = 32
+
+# Bump whenever a change makes analyze give different results, so results
+# cached by earlier versions are not used anymore.
+ANALYZER_VERSION = 3
+
+INGREDIENTS = 'ingredients'
+INSTRUCTIONS = 'instructions'
+# A note in brackets at the end of a header, with any markup after it, as in
+# '**Ingredients (serves 4):**'.
+header_note = re.compile(r'\s*[(\[][^()\[\]]*[)\]]\W*$')
 
 ingredients_terms = ['ingredients', 'ingredient', 'shopping list']
 instructions_terms = ['instructions', 'instruction', 'method', 'directions']
 
-# First element in each value is the fuzz ratio
-recipe_titles = {}
+# Ties go to the meal type listed first.
+meal_type_terms = OrderedDict([
+    ('Breakfast', ['breakfast', 'morning', 'wake up']),
+    ('Lunch', ['lunch', 'afternoon', 'break']),
+    ('Dinner', ['dinner', 'night', 'sleep', 'family dinner', 'supper'])])
+
+punctuation_table = str.maketrans('', '', string.punctuation)
+
+section_matcher = None
+meal_type_matcher = None
+
+
+def configure_keywords(ingredients=None, instructions=None, meal_types=None):
+    """Replace the vocabularies used to find sections and meal types.
+
+    Any vocabulary left out is kept as it is. Worker processes started with
+    start_pool afterwards use the new vocabularies too.
+
+    :param ingredients The terms that head an ingredients section.
+    :param instructions The terms that head an instructions section.
+    :param meal_types A mapping of meal type to the terms hinting at it,
+    ordered by preference.
+    """
+
+    global ingredients_terms, instructions_terms, meal_type_terms
+    global section_matcher, meal_type_matcher
+
+    if ingredients is not None:
+        ingredients_terms = list(ingredients)
+    if instructions is not None:
+        instructions_terms = list(instructions)
+    if meal_types is not None:
+        meal_type_terms = OrderedDict(meal_types)
+
+    section_matcher = KeywordMatcher(OrderedDict([
+        (INGREDIENTS, ingredients_terms), (INSTRUCTIONS, instructions_terms)]))
+    meal_type_matcher = KeywordMatcher(meal_type_terms)
+
+
+configure_keywords()
+
+
+def start_pool(workers):
+    """
+    Starts worker processes for analyze_timed, set up with the vocabularies
+    of this process, whether they are forked or spawned.
+
+    :param workers: The amount of processes.
+    :return: The ProcessPoolExecutor.
+    """
+
+    # Loaded before the workers start, so forked ones can share it.
+    get_title_index()
+    return ProcessPoolExecutor(max_workers=workers,
+                               initializer=configure_keywords,
+                               initargs=(ingredients_terms,
+                                         instructions_terms,
+                                         meal_type_terms))
+
+
+def get_analysis_version():
+    """
+    Identifies everything the results of analyze depend on: the analyzer
+    version, the section vocabularies and the title list. Meal types are
+    left out, since the type is not part of the result.
+
+    :return: A version string, for keying cached results.
+    """
+
+    fingerprint = hashlib.sha1('\0'.join(
+        ingredients_terms + ['\1'] + instructions_terms).encode('utf-8'))
+    fingerprint.update(get_cache_header(TITLES_PATH))
+    return '{0}-{1}'.format(ANALYZER_VERSION, fingerprint.hexdigest())
+
+
+# Loaded on first use, see get_title_index.
+title_index = None
+
+
+def analyze(raw_post):
+    """Analyze a fetched post and pull a recipe out of it if it has one.
+
+    Only works on plain text, so it can run in a worker process. The recipe
+    type is left empty since it depends on the whole thread, not the post.
+
+    :param raw_post The RawPost to analyze.
+    :return: The RefinedPost of the recipe, or None if it is not a recipe.
+    """
+
+    return analyze_timed(raw_post)[0]
+
+
+def analyze_timed(raw_post):
+    """
+    Analyze a fetched post like analyze, also measuring how long parsing
+    and title matching took, so worker processes can report it back.
+
+    :param raw_post The RawPost to analyze.
+    :return: The RefinedPost of the recipe or None, and a dict of stage name
+    to seconds.
+    """
+
+    content = raw_post.content
+    start = perf_counter()
+    parsed_post = parse_post(content)
+    timings = {'section_parsing': perf_counter() - start}
 
-with open('../misc/recipe_titles.txt') as titles:
-    lines = titles.readlines()
-    for line in lines:
-        recipe_titles[line[:-1]] = 0
+    if not parsed_post.is_recipe:
+        return None, timings
+
+    start = perf_counter()
+    title = determine_title(' '.join((raw_post.title, content)))
+    timings['title_match'] = perf_counter() - start
+
+    return RefinedPost(title, parsed_post.ingredients,
+                       parsed_post.instructions, None), timings
+
+
+def analyze_many(raw_posts, analysis_cache, pool=None):
+    """
+    Analyzes posts in the worker pool, if there is one. Posts whose
+    results are in the analysis cache are not analyzed again, and the
+    results of the others are added to it.
+
+    :param raw_posts: The RawPosts to analyze.
+    :param analysis_cache: The AnalysisCache to look the posts up in.
+    :param pool: The executor from start_pool, or None to analyze every
+    post in this process.
+    :return: A list of RefinedPosts or None, in the same order as the
+    posts.
+    """
+
+    with metrics.time('analysis'):
+        cached = analysis_cache.get_many(raw_posts)
+        misses = [raw_post for raw_post, (found, _) in
+                  zip(raw_posts, cached) if not found]
+        metrics.count('posts_analyzed', len(misses))
+        metrics.count('analysis_cache_hits', len(raw_posts) - len(misses))
+
+        if pool is None:
+            analyzed = map(analyze_timed, misses)
+        else:
+            analyzed = pool.map(analyze_timed, misses,
+                                chunksize=ANALYSIS_CHUNK_SIZE)
+
+        results = []
+        for raw_post, (found, refined_post) in zip(raw_posts, cached):
+            if not found:
+                refined_post, timings = next(analyzed)
+                for stage, seconds in timings.items():
+                    metrics.observe(stage, seconds)
+                analysis_cache.put(raw_post, refined_post)
+            results.append(refined_post)
+        return results
+
+
+def parse_post(content):
+    """Analyze the contents of a post in a single pass over its lines.
+
+    Gives the same results as determine_if_recipe, get_ingredients and
+    get_instructions, while splitting and cleaning every line only once.
+
+    :param content The post to analyze.
+    :return: The ParsedPost.
+    """
+
+    ingredients = []
+    instructions = []
+    has_ingredients = False
+    has_instructions = False
+    in_ingredients = False
+
+    for line in content.split('\n'):
+        if has_instructions:
+            instructions.append('- ' + line)
+
+        section = get_section(line)
+
+        if in_ingredients:
+            if section == INSTRUCTIONS:
+                in_ingredients = False
+            else:
+                ingredients.append('- ' + line)
+        elif not has_ingredients and section == INGREDIENTS:
+            has_ingredients = True
+            in_ingredients = True
+
+        if not has_instructions and section == INSTRUCTIONS:
+            has_instructions = True
+
+    ingredients = clean_list(ingredients)
+    instructions = clean_list(instructions)
+    return ParsedPost(has_lines(ingredients) and has_lines(instructions),
+                      ingredients, instructions)
 
 
 def determine_title(post):
@@ -25,24 +237,65 @@ def determine_title(post):
     :param post The post to analyze.
     """
 
+    return rank_titles(post, limit=1)[0][0]
+
+
+def rank_titles(post, limit=5):
+    """Analyze the post and rank the recipe titles that suit it best.
+
+    :param post The post to analyze.
+    :param limit The number of titles to return.
+    :return: A list of (title, score) tuples, best match first.
+    """
+
+    # Used token set ratio to block out noise within the post.
+    return get_title_index().top_titles(get_title_text(post), limit)
+
+
+def determine_titles(posts):
+    """Analyze many posts at once and determine a recipe title for each.
+
+    Faster than calling determine_title for every post when reprocessing
+    a large amount of posts.
+
+    :param posts The posts to analyze.
+    :return: A list of titles, in the same order as the posts.
+    """
+
+    texts = [get_title_text(post) for post in posts]
+    return [ranked[0][0]
+            for ranked in get_title_index().top_titles_batch(texts)]
+
+
+def get_title_index():
+    """Get the index of known recipe titles, loading it on first use."""
+
+    global title_index
+
+    if title_index is None:
+        title_index = load_title_index(TITLES_PATH, TITLES_CACHE_PATH)
+
+    return title_index
+
+
+def get_title_text(post):
+    """Gets the text of a post that is used to determine its title.
+
+    :param post The submission or comment to get the text of, or the text
+    itself.
+    """
+
     post_title = ''
 
-    if isinstance(post, objects.Submission):
+    if isinstance(post, str):
+        return post
+    elif hasattr(post, 'selftext'):  # Submission
         post_title = post.title
         post_text = post.selftext
     else:  # Comment
         post_text = post.body
 
-    text_to_analyze = ' '.join((post_title, post_text))
-
-    for key in recipe_titles:
-        # Used token set ratio to block out noise within the post.
-        token_set_ratio = fuzz.token_set_ratio(key, text_to_analyze)
-        recipe_titles[key] = token_set_ratio
-
-    title = max(recipe_titles, key=recipe_titles.get)
-
-    return title
+    return ' '.join((post_title, post_text))
 
 
 def get_ingredients(content):
@@ -55,9 +308,9 @@ def get_ingredients(content):
 
     lines = content.split('\n')
     for line_num, line in enumerate(lines):
-        if clean_up(line) in ingredients_terms:
+        if get_section(line) == INGREDIENTS:
             for ingredient_line in lines[line_num + 1:]:
-                if clean_up(ingredient_line) not in instructions_terms:
+                if get_section(ingredient_line) != INSTRUCTIONS:
                     ingredients.append('- ' + ingredient_line)
                 else:
                     break
@@ -78,7 +331,7 @@ def get_instructions(content):
 
     lines = content.split('\n')
     for line_num, line in enumerate(lines):
-        if clean_up(line) in instructions_terms:
+        if get_section(line) == INSTRUCTIONS:
             for instruction_line in lines[line_num + 1:]:
                 instructions.append('- ' + instruction_line)
             break
@@ -94,11 +347,9 @@ def determine_if_recipe(content):
     :param content The post to analyze.
     """
 
-    lines = content.split('\n')
-    has_ingredients = any(line in ingredients_terms for line in lines)
-    has_instructions = any(line in instructions_terms for line in lines)
-
-    return has_ingredients and has_instructions
+    # A section only counts if there is something in it.
+    return has_lines(get_ingredients(content)) and \
+        has_lines(get_instructions(content))
 
 
 def determine_type(post):
@@ -108,24 +359,33 @@ def determine_type(post):
     :param post: The post to analyze.
     """
 
-    post = post.split()
-    post = clean_list(post)
+    return pick_type(count_types(post))
+
+
+def count_types(post):
+    """
+    Counts the hints at each meal type in a post. The counts of several
+    posts can be added up and passed to pick_type, to find the type of a
+    thread without joining all of its text.
+
+    :param post: The post to scan.
+    :return: A dict of meal type to count, holding every meal type.
+    """
+
+    # Single spaces between words, so phrases like 'wake up' match.
+    post = ' '.join(clean_up(post).split())
+
+    return meal_type_matcher.count(post)
 
-    breakfast_terms = ['breakfast', 'morning', 'wake up']
-    lunch_terms = ['lunch', 'afternoon', 'break']
-    dinner_terms = ['dinner', 'night', 'sleep', 'family dinner', 'supper']
 
-    type_dict = {'Breakfast': 0, 'Lunch': 0, 'Dinner': 0}
+def pick_type(type_dict):
+    """Picks the recipe type most hinted at.
 
-    for word in post:
-        if word in breakfast_terms:
-            type_dict['Breakfast'] += 1
-        elif word in lunch_terms:
-            type_dict['Lunch'] += 1
-        elif word in dinner_terms:
-            type_dict['Dinner'] += 1
+    :param type_dict: A dict of meal type to count, as from count_types.
+    :return: The recipe type.
+    """
 
-    recipe_type = max(type_dict, key=type_dict.get)
+    recipe_type = max(meal_type_terms, key=type_dict.get)
 
     if type_dict[recipe_type] == 0:
         recipe_type = 'All meals!'
@@ -133,6 +393,31 @@ def determine_type(post):
     return recipe_type
 
 
+def get_section(line):
+    """Determine which section a line is the header of, if any.
+
+    A header is a line that is only a section keyword once markup and a
+    trailing note in brackets are left out, e.g. '## Ingredients (for 2):',
+    so sentences that merely mention a keyword are not taken for one.
+
+    :param line: The line to check.
+    :return: INGREDIENTS, INSTRUCTIONS or None.
+    """
+
+    header = ' '.join(clean_up(header_note.sub('', line)).split())
+    return section_matcher.match_header(header)
+
+
+def has_lines(section):
+    """Tells whether a section, as from clean_list, has any text in it.
+
+    :param section: The list of '- ' prefixed lines.
+    :return: True if a line holds more than whitespace.
+    """
+
+    return any(line[2:].strip() for line in section)
+
+
 def clean_up(text):
     """
     Formats the body of text to remove extraneous formatting for easier
@@ -143,8 +428,7 @@ def clean_up(text):
     :return: A clean body of text.
     """
 
-    regex = re.compile('[%s]' % re.escape(string.punctuation))
-    clean_text = regex.sub('', text)
+    clean_text = text.translate(punctuation_table)
     return clean_text.lower()
 
 
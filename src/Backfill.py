@@ -0,0 +1,307 @@
+"""Imports recipes from Reddit dump files, without PRAW or the network.
+
+Reads submissions and comments from JSON lines files, as found in the
+Pushshift archives, plain or compressed with gzip, bz2, xz or zstandard.
+Run from the src directory, like the bot itself:
+
+    python -m src.Backfill ../dumps/RS_2019-01.zst ../dumps/RC_2019-01.zst
+
+An interrupted import picks up where it stopped when run again.
+"""
+
+import argparse
+import bz2
+import gzip
+import io
+import json
+import lzma
+import os
+from src.AnalysisCache import AnalysisCache
+from src.DatabaseUtil import Database, DATABASE_PATH
+from src.Recipe import Recipe, PostInfo, RawPost
+from src import Analyzer
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SUBREDDIT = 'EatCheapAndHealthy'
+REDDIT_URL = 'https://www.reddit.com'
+BATCH_SIZE = 2000
+ANALYSIS_WORKERS = 4
+# Pushshift dumps are compressed with a long window.
+ZSTD_WINDOW_SIZE = 1 << 31
+DELETED_AUTHORS = ('[deleted]', '[removed]', None)
+
+
+def open_dump(path, offset=0):
+    """Opens a dump file as bytes, decompressing it by its extension.
+
+    Plain files seek straight to the offset. Compressed ones have to be
+    decompressed up to it, but the skipped part is not split into lines or
+    decoded.
+
+    :param path: The .jsonl, .gz, .bz2, .xz or .zst file.
+    :param offset: How many bytes of the decompressed dump to skip.
+    :return: The binary stream of the file, at the offset.
+    """
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.gz':
+        dump = gzip.open(path, 'rb')
+    elif extension == '.bz2':
+        dump = bz2.open(path, 'rb')
+    elif extension in ('.xz', '.lzma'):
+        dump = lzma.open(path, 'rb')
+    elif extension == '.zst':
+        if zstandard is None:
+            raise RuntimeError('Reading ' + path + ' needs the zstandard '
+                               'package.')
+        decompressor = zstandard.ZstdDecompressor(
+            max_window_size=ZSTD_WINDOW_SIZE)
+        reader = decompressor.stream_reader(open(path, 'rb'))
+        # The reader can only seek forward, which is all that is needed.
+        reader.seek(offset)
+        return io.BufferedReader(reader)
+    else:
+        dump = open(path, 'rb')
+    dump.seek(offset)
+    return dump
+
+
+def get_raw_post(record, subreddit=SUBREDDIT):
+    """Copies the text and details of a dumped post needed for analysis.
+
+    :param record: The decoded JSON of a submission or comment.
+    :param subreddit: Only posts from this subreddit are kept, if given.
+    :return: The RawPost, or None if the post should be skipped.
+    """
+
+    if subreddit and \
+            record.get('subreddit', subreddit).lower() != subreddit.lower():
+        return None
+    if record.get('author') in DELETED_AUTHORS:
+        return None
+
+    if 'title' in record:  # Submission
+        title = record['title']
+        content = record.get('selftext') or ''
+        url = get_url(record.get('permalink') or record.get('url'))
+    else:  # Comment
+        title = ''
+        content = record.get('body') or ''
+        if record.get('permalink'):
+            url = get_url(record['permalink'])
+        else:
+            url = '{0}/r/{1}/comments/{2}/_/{3}'.format(
+                REDDIT_URL, record.get('subreddit', subreddit),
+                record.get('link_id', 't3_')[3:], record['id'])
+
+    post_info = PostInfo(record['author'], record.get('score', 0),
+                         int(record.get('created_utc', 0)), record['id'], url)
+    return RawPost(post_info, title, content)
+
+
+def get_url(permalink):
+    """Turns the site relative permalinks of newer dumps into full URLs."""
+
+    if permalink and permalink.startswith('/'):
+        return REDDIT_URL + permalink
+    return permalink
+
+
+class Backfill:
+    """
+    Imports dump files in batches: every batch is analyzed in the worker
+    pool, its recipes are stored in one transaction, and then the line and
+    byte offset the file was read up to are recorded, so a resumed import
+    seeks past the lines that were done instead of reading them again.
+
+    A batch that was stored but not recorded is read again on the next run,
+    which does no harm, since recipes that are already stored are skipped.
+    """
+
+    def __init__(self, db, workers=ANALYSIS_WORKERS, subreddit=SUBREDDIT,
+                 batch_size=BATCH_SIZE):
+        """
+        :param db: The Database to load the recipes into.
+        :param workers: The amount of processes used to analyze posts. With 0
+        every post is analyzed in this process.
+        :param subreddit: Only posts from this subreddit are imported, if
+        given.
+        :param batch_size: How many posts are analyzed and stored at once.
+        """
+
+        self.db = db
+        self.cursor = db.connection.cursor()
+        self.workers = workers
+        self.subreddit = subreddit
+        self.batch_size = batch_size
+        self.analysis_cache = AnalysisCache(db,
+                                            Analyzer.get_analysis_version())
+        self.pool = None
+        self.lines = 0
+        self.posts = 0
+        self.recipes = 0
+        self.bad_lines = 0
+
+    def run(self, paths):
+        """Imports several dump files, one after another.
+
+        :param paths: The dump files to import.
+        """
+
+        # The vocabularies or the title list may have changed since.
+        self.analysis_cache.version = Analyzer.get_analysis_version()
+        if self.workers > 0:
+            self.pool = Analyzer.start_pool(self.workers)
+        try:
+            for path in paths:
+                self.import_file(path)
+        finally:
+            self.analysis_cache.flush()
+            if self.pool is not None:
+                self.pool.shutdown()
+                self.pool = None
+        print('Backfill:', self)
+        print('Analysis cache:', self.analysis_cache)
+
+    def import_file(self, path):
+        """Imports a single dump file, resuming from its checkpoint.
+
+        :param path: The dump file to import.
+        """
+
+        path = os.path.abspath(path)
+        start, offset, finished = self.get_checkpoint(path)
+        if finished:
+            print('Already imported', path)
+            return
+        if start:
+            print('Resuming', path, 'after line', start)
+        else:
+            print('Importing', path)
+
+        batch = []
+        # Checkpoints from before offsets were recorded only have the line,
+        # so those imports read the dump from the start again.
+        line_num = start if offset else 0
+        with open_dump(path, offset) as dump:
+            for line in dump:
+                line_num += 1
+                offset += len(line)
+                if line_num <= start:
+                    continue
+                self.lines += 1
+                try:
+                    raw_post = get_raw_post(json.loads(line.decode('utf-8')),
+                                            self.subreddit)
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    self.bad_lines += 1
+                    continue
+                if raw_post is not None:
+                    batch.append(raw_post)
+                if len(batch) >= self.batch_size:
+                    self.store_batch(batch)
+                    self.save_checkpoint(path, line_num, offset, False)
+                    batch = []
+
+        self.store_batch(batch)
+        self.save_checkpoint(path, max(line_num, start), offset, True)
+
+    def store_batch(self, raw_posts):
+        """Analyzes a batch of posts and stores the recipes found.
+
+        :param raw_posts: The RawPosts to analyze.
+        """
+
+        recipes = []
+        for raw_post, refined_post in zip(raw_posts,
+                                          self.analyze(raw_posts)):
+            if refined_post is not None:
+                # Dumps are not grouped by thread, so the type comes from
+                # the text of the post itself.
+                refined_post.type = Analyzer.determine_type(Analyzer.clean_up(
+                    raw_post.title + '\n' + raw_post.content))
+                recipes.append(Recipe(raw_post.post_info, refined_post))
+
+        self.posts += len(raw_posts)
+        if recipes:
+            self.recipes += self.db.add_many(recipes)
+
+    def analyze(self, raw_posts):
+        """Analyzes posts with the worker pool and the analysis cache.
+
+        :param raw_posts: The RawPosts to analyze.
+        :return: A list of RefinedPosts or None, in the same order as the
+        posts.
+        """
+
+        return Analyzer.analyze_many(raw_posts, self.analysis_cache,
+                                     self.pool)
+
+    def get_checkpoint(self, path):
+        """Looks up how far a dump file was imported.
+
+        :param path: The absolute path of the dump file.
+        :return: The amount of lines done, the amount of decompressed bytes
+        they took up, and whether the file is done.
+        """
+
+        row = self.cursor.execute('SELECT line, byte_offset, finished FROM '
+                                  'BackfillProgress WHERE path = ?',
+                                  [path]).fetchone()
+        if row is None:
+            return 0, 0, False
+        return row[0], row[1], bool(row[2])
+
+    def save_checkpoint(self, path, line_num, offset, finished):
+        """Records how far a dump file was imported.
+
+        :param path: The absolute path of the dump file.
+        :param line_num: The amount of lines whose posts were stored.
+        :param offset: The decompressed byte offset of the line after them.
+        :param finished: Whether the whole file was imported.
+        """
+
+        with self.db.connection:
+            self.cursor.execute('INSERT OR REPLACE INTO BackfillProgress '
+                                '(path, line, finished, byte_offset) '
+                                'VALUES(?, ?, ?, ?)',
+                                [path, line_num, int(finished), offset])
+
+    def __str__(self):
+        return '{0} lines read, {1} posts analyzed, {2} recipes added, ' \
+               '{3} bad lines'.format(self.lines, self.posts, self.recipes,
+                                      self.bad_lines)
+
+
+def main(argv=None):
+    """Imports the dump files given on the command line."""
+
+    parser = argparse.ArgumentParser(
+        description='Import recipes from Reddit dump files.')
+    parser.add_argument('paths', nargs='+', metavar='dump',
+                        help='JSON lines file, optionally compressed')
+    parser.add_argument('--database', default=DATABASE_PATH,
+                        help='the recipe database to load into')
+    parser.add_argument('--workers', type=int, default=ANALYSIS_WORKERS,
+                        help='analysis processes, 0 to analyze in-process')
+    parser.add_argument('--subreddit', default=SUBREDDIT,
+                        help='only import posts from this subreddit, '
+                             'empty for all')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help='posts analyzed and stored at once')
+    args = parser.parse_args(argv)
+
+    db = Database(args.database)
+    try:
+        Backfill(db, args.workers, args.subreddit,
+                 args.batch_size).run(args.paths)
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
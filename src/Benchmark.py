@@ -0,0 +1,851 @@
+"""Timing helpers for the slow parts of the bot.
+
+Run from the src directory, like the bot itself:
+
+    python -m src.Benchmark --quick --output results.json
+    python -m src.Benchmark --quick --compare results.json
+
+Every stage runs on fixed synthetic data, so runs on the same machine can
+be compared.
+"""
+
+import argparse
+import heapq
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from collections import OrderedDict
+from time import perf_counter, time
+from src import Analyzer, Synthetic
+from src.DatabaseUtil import Database, RECIPE_COLUMNS
+from src.FakeSource import FakeSource
+from src.Fetcher import Fetcher
+from src.IngredientIndex import canonicalize
+from src.NearDuplicate import NUM_PERMUTATIONS, pack_signature
+from src.Recipe import Recipe
+from src.RedditSource import SourceError
+from src.RecipeHandler import write_digest, DIGEST_ORDER
+from src.Scraper import RedditAPI
+
+SIZES = (10000, 100000, 1000000)
+QUICK_SIZES = (10000, 20000)
+# The parameters that tell the results in a list apart.
+LIST_KEYS = ('size', 'batch_size', 'workers')
+UNLIMITED_RATE = 1e9
+
+
+def compare_title_matching(texts):
+    """
+    Checks the indexed title matcher against the exhaustive scan on a
+    reference corpus and times both.
+
+    :param texts: The bodies of text to find titles for.
+    :return: A dict with the agreement rate and the seconds spent by each
+    matcher.
+    """
+
+    index = Analyzer.get_title_index()
+    agreed = 0
+    indexed_seconds = 0.0
+    scan_seconds = 0.0
+
+    for text in texts:
+        start = perf_counter()
+        indexed = index.top_titles(text)[0]
+        indexed_seconds += perf_counter() - start
+
+        start = perf_counter()
+        scanned = index.scan(text)[0]
+        scan_seconds += perf_counter() - start
+
+        if indexed == scanned:
+            agreed += 1
+        else:
+            print('Mismatch:', indexed, 'vs', scanned)
+
+    return {'agreement': agreed / max(len(texts), 1),
+            'indexed_seconds': indexed_seconds,
+            'scan_seconds': scan_seconds}
+
+
+def title_throughput(texts):
+    """Measures how many posts per second each title matching path handles.
+
+    :param texts: The bodies of text to find titles for.
+    :return: A dict with the posts per second of the per post and the batch
+    path.
+    """
+
+    start = perf_counter()
+    for text in texts:
+        Analyzer.determine_title(text)
+    per_post_seconds = perf_counter() - start
+
+    start = perf_counter()
+    Analyzer.determine_titles(texts)
+    batch_seconds = perf_counter() - start
+
+    return {'per_post': len(texts) / per_post_seconds,
+            'batch': len(texts) / batch_seconds}
+
+
+def type_detection(texts):
+    """Measures how many thread texts per second determine_type handles.
+
+    :param texts: The cleaned up thread texts to classify.
+    :return: A dict with the texts per second and the share of each type.
+    """
+
+    start = perf_counter()
+    types = [Analyzer.determine_type(text) for text in texts]
+    seconds = perf_counter() - start
+
+    result = {'per_second': len(texts) / seconds}
+    for recipe_type in set(types):
+        result[recipe_type] = types.count(recipe_type) / len(types)
+    return result
+
+
+def insert_throughput(count=5000, batch_sizes=(1, 25, 500)):
+    """
+    Measures how many recipes per second Database.add_many stores when
+    handed batches of several sizes, into a file on disk.
+
+    :param count: How many recipes to store per batch size.
+    :param batch_sizes: The batch sizes to test with.
+    :return: A list of dicts with the batch size and recipes per second.
+    """
+
+    recipes = [Recipe.from_values(row[0], row[1], row[2], row[3], row[4],
+                                  row[5].split(';'), row[6].split(';'),
+                                  row[7], row[8])
+               for row in Synthetic.recipe_rows(count)]
+
+    results = []
+    for batch_size in batch_sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            db = Database(os.path.join(directory, 'recipes.sqlite'))
+            start = perf_counter()
+            for batch_start in range(0, count, batch_size):
+                db.add_many(recipes[batch_start:batch_start + batch_size])
+            seconds = perf_counter() - start
+            db.close()
+        results.append({'batch_size': batch_size,
+                        'per_second': count / seconds})
+    return results
+
+
+def fill_database(db, count, **options):
+    """Fills a database with synthetic recipes.
+
+    :param db: The Database to fill.
+    :param count: How many recipes to add.
+    :param options: Passed on to Synthetic.recipe_rows.
+    """
+
+    with db.connection:
+        db.cursor.executemany('INSERT INTO Recipes (' + RECIPE_COLUMNS +
+                              ') VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                              Synthetic.recipe_rows(count, **options))
+
+
+def time_call(function, *args, repeat=5):
+    """Times a function call.
+
+    :param function: The function to call.
+    :param repeat: How many times to call it.
+    :return: The fastest time in seconds.
+    """
+
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        function(*args)
+        best = min(best, perf_counter() - start)
+    return best
+
+
+def query_latency(sizes=(10000, 100000, 1000000)):
+    """
+    Times the weekly and per author queries on databases of several sizes,
+    with and without the query indexes.
+
+    :param sizes: The amounts of recipes to test with.
+    :return: A list of dicts with the size and the query times.
+    """
+
+    results = []
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            db = Database(os.path.join(directory, 'recipes.sqlite'))
+            fill_database(db, size)
+            result = {'size': size}
+            for indexed in (True, False):
+                if not indexed:
+                    for index in ('Recipes_time', 'Recipes_author',
+                                  'Recipes_time_karma'):
+                        db.cursor.execute('DROP INDEX ' + index)
+                suffix = '' if indexed else '_unindexed'
+                result['weekly' + suffix] = time_call(
+                    db.get_last_weeks_recipes)
+                result['author' + suffix] = time_call(
+                    db.get_recipes_from_author, 'user42')
+            db.close()
+        results.append(result)
+    return results
+
+
+def peak_memory(function, *args):
+    """Measures the peak memory allocated while a function runs.
+
+    :param function: The function to call.
+    :return: The peak in bytes.
+    """
+
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def export_memory(sizes=(10000, 100000)):
+    """
+    Measures the peak memory of exporting the whole archive as text, once
+    streaming the recipes and once loading them all into a list first.
+
+    :param sizes: The amounts of recipes to test with.
+    :return: A list of dicts with the size and both peaks in bytes.
+    """
+
+    def export(recipes):
+        with open(os.devnull, 'w') as output:
+            for recipe in recipes:
+                output.write(str(recipe))
+
+    results = []
+    for size in sizes:
+        db = Database(':memory:')
+        fill_database(db, size)
+        results.append({
+            'size': size,
+            'streaming': peak_memory(
+                lambda: export(db.iter_all_recipes())),
+            'list': peak_memory(
+                lambda: export(list(db.iter_all_recipes())))})
+        db.close()
+    return results
+
+
+class DictRecipe:
+    """The recipe layout before __slots__, kept for comparison."""
+
+    def __init__(self, values):
+        self.id, self.author, self.karma, self.url, self.title, \
+            self.ingredients, self.instructions, self.type, \
+            self.time = values
+
+
+def recipe_footprint(count=20000):
+    """Compares the memory held per recipe by both recipe layouts.
+
+    :param count: How many recipes to build for each layout.
+    :return: A dict with the bytes per recipe of each layout.
+    """
+
+    rows = []
+    for row in Synthetic.recipe_rows(count):
+        row = list(row)
+        row[5] = row[5].split(';')
+        row[6] = row[6].split(';')
+        rows.append(row)
+
+    def held(build):
+        tracemalloc.start()
+        try:
+            recipes = [build(row) for row in rows]
+            size = tracemalloc.get_traced_memory()[0]
+            del recipes
+            return size / count
+        finally:
+            tracemalloc.stop()
+
+    return {'dict': held(lambda row: DictRecipe([
+                row[0], row[1], row[2], row[3], row[4], list(row[5]),
+                list(row[6]), row[7], row[8]])),
+            'slots': held(lambda row: Recipe.from_values(*row))}
+
+
+def digest_cost(count=50000, top_n=None):
+    """
+    Times the weekly digest and measures its peak memory for a week with
+    many recipes, writing to a file, to memory, and the old way of sorting
+    the whole week in Python first.
+
+    :param count: How many recipes were posted during the week.
+    :param top_n: Only write this many of the top recipes, if given.
+    :return: A dict of dicts with the seconds and peak bytes per way of
+    writing.
+    """
+
+    db = Database(':memory:')
+    # Every row lands inside the window of get_last_weeks_recipes.
+    fill_database(db, count, newest=86400 + 60, span=604800 - 120)
+
+    def to_file():
+        with open(os.devnull, 'w') as weekly_doc:
+            write_digest(db.iter_last_weeks_recipes(DIGEST_ORDER, top_n),
+                         weekly_doc)
+
+    def to_memory():
+        weekly_doc = io.TextIOWrapper(io.BytesIO(), encoding='utf-8',
+                                      write_through=True)
+        write_digest(db.iter_last_weeks_recipes(DIGEST_ORDER, top_n),
+                     weekly_doc)
+
+    def sorted_in_python():
+        recipes = db.get_last_weeks_recipes()
+        recipes.sort(key=lambda recipe: recipe.karma, reverse=True)
+        with open(os.devnull, 'w') as weekly_doc:
+            write_digest(recipes[:top_n], weekly_doc)
+
+    results = {}
+    for name, function in (('file', to_file), ('memory', to_memory),
+                           ('sorted_in_python', sorted_in_python)):
+        results[name] = {'seconds': time_call(function, repeat=1),
+                         'peak': peak_memory(function)}
+    db.close()
+    return results
+
+
+# Posts with the sections the parsers must find in them, as (content,
+# is_recipe, ingredients, instructions). Lines that only mention a section
+# keyword are not headers.
+SECTION_CASES = [
+    ('Ingredients are the key here.\nThe method doesn\'t matter much.',
+     False, [], []),
+    ('Cheap ingredients matter.\nFollow the directions on the box.',
+     False, [], []),
+    ('Ingredients\n\nInstructions\n', False, [], []),
+    ('**Ingredients (serves 2):**\n2 eggs\n\n## Method\n'
+     'Method of cooking: boil\nEat',
+     True, ['- 2 eggs'], ['- Method of cooking: boil', '- Eat']),
+    ('Shopping list:\n- rice\nDirections\nCook the rice',
+     True, ['- - rice'], ['- Cook the rice']),
+]
+
+
+def section_parsing(contents):
+    """
+    Times the single pass parser against the separate section functions
+    and checks that both give the same results.
+
+    :param contents: The post bodies to parse.
+    :return: A dict with the seconds spent by each and whether they agree.
+    """
+
+    def separately():
+        results = []
+        for content in contents:
+            is_recipe = Analyzer.determine_if_recipe(content)
+            results.append((is_recipe, Analyzer.get_ingredients(content),
+                            Analyzer.get_instructions(content)))
+        return results
+
+    def single_pass():
+        results = []
+        for content in contents:
+            parsed_post = Analyzer.parse_post(content)
+            results.append((parsed_post.is_recipe, parsed_post.ingredients,
+                            parsed_post.instructions))
+        return results
+
+    def cases_pass():
+        for content, is_recipe, ingredients, instructions in SECTION_CASES:
+            expected = (is_recipe, ingredients, instructions)
+            parsed_post = Analyzer.parse_post(content)
+            if (parsed_post.is_recipe, parsed_post.ingredients,
+                    parsed_post.instructions) != expected or \
+                    (Analyzer.determine_if_recipe(content),
+                     Analyzer.get_ingredients(content),
+                     Analyzer.get_instructions(content)) != expected:
+                return False
+        return True
+
+    return {'separate': time_call(separately),
+            'single_pass': time_call(single_pass),
+            'agree': separately() == single_pass(),
+            'cases': cases_pass()}
+
+
+def startup_time():
+    """
+    Times importing the Analyzer and loading the title index in a fresh
+    interpreter, once with no title cache and once with a warm one.
+
+    :return: A dict with the import time and the cold and warm load times.
+    """
+
+    script = ('from time import perf_counter\n'
+              'start = perf_counter()\n'
+              'from src import Analyzer\n'
+              'imported = perf_counter()\n'
+              'Analyzer.get_title_index()\n'
+              'print(imported - start, perf_counter() - imported)\n')
+    root = os.path.join(Analyzer.MISC_DIR, '..')
+
+    def run():
+        output = subprocess.check_output([sys.executable, '-c', script],
+                                         cwd=root)
+        return [float(value) for value in output.split()[-2:]]
+
+    if os.path.exists(Analyzer.TITLES_CACHE_PATH):
+        os.remove(Analyzer.TITLES_CACHE_PATH)
+    import_seconds, cold_seconds = run()
+    warm_seconds = run()[1]
+
+    return {'import': import_seconds, 'cold': cold_seconds,
+            'warm': warm_seconds}
+
+
+def near_copy(recipe, post_id, rng):
+    """Copies a recipe with one more instruction, as reposts often have.
+
+    :param recipe: The recipe to copy.
+    :param post_id: The id of the copy.
+    :param rng: The random.Random instance to draw the new step from.
+    :return: The new Recipe.
+    """
+
+    step = rng.choice(Synthetic.STEPS).format(rng.choice(Synthetic.FOODS))
+    return Recipe.from_values(post_id, 'author', 1, 'url', recipe.title,
+                              recipe.ingredients,
+                              list(recipe.instructions) + [step], 'Dinner', 0)
+
+
+def duplicate_lookup(sizes=(10000, 100000, 1000000), lookups=200,
+                     copies=4):
+    """
+    Times the near duplicate lookup of new recipes against LSH indexes
+    holding several amounts of stored recipes, and checks that the copies
+    are found.
+
+    Every new recipe is a near copy of a stored original, which has more
+    stored copies. Those have their real MinHash signatures, so a lookup
+    compares against all of them. The other stored recipes get random
+    signatures, like unrelated recipes would, as hashing millions of
+    recipes would take far too long.
+
+    :param sizes: The amounts of stored recipes to test with.
+    :param lookups: How many new recipes to look up.
+    :param copies: How many copies of each original are stored with it.
+    :return: A list of dicts with the size, the seconds per lookup and the
+    share of new recipes flagged as duplicates.
+    """
+
+    titles = Synthetic.load_titles()
+    rng = random.Random(0)
+    originals = []
+    for recipe_num in range(lookups):
+        title, body = Synthetic.recipe_post(rng, titles, 8)
+        parsed_post = Analyzer.parse_post(body)
+        originals.append(Recipe.from_values(
+            'original{0}'.format(recipe_num), 'author', 1, 'url', title,
+            parsed_post.ingredients, parsed_post.instructions, 'Dinner', 0))
+    stored_copies = [near_copy(original, 'copy{0}_{1}'.format(recipe_num,
+                                                              copy_num), rng)
+                     for recipe_num, original in enumerate(originals)
+                     for copy_num in range(copies)]
+    new_recipes = [near_copy(original, 'new{0}'.format(recipe_num), rng)
+                   for recipe_num, original in enumerate(originals)]
+
+    results = []
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            db = Database(os.path.join(directory, 'recipes.sqlite'))
+            db.add_many(originals + stored_copies)
+            fill_database(db, size)
+            signatures = [(row_num, tuple(rng.getrandbits(32) for _ in
+                                          range(NUM_PERMUTATIONS)))
+                          for row_num in range(size)]
+            with db.connection:
+                db.cursor.executemany(
+                    'INSERT INTO RecipeSignatures VALUES(?, ?)',
+                    (('p{0}'.format(row_num), pack_signature(signature))
+                     for row_num, signature in signatures))
+                db.cursor.executemany(
+                    'INSERT INTO RecipeBands VALUES(?, ?, ?)',
+                    ((bucket, band, 'p{0}'.format(row_num))
+                     for row_num, signature in signatures
+                     for band, bucket in db.hasher.get_buckets(signature)))
+            del signatures
+
+            start = perf_counter()
+            _, duplicates = db.find_near_duplicates(new_recipes)
+            seconds = perf_counter() - start
+            db.close()
+        results.append({'size': size, 'lookup': seconds / lookups,
+                        'found': len(duplicates) / lookups})
+    return results
+
+
+def search_latency(sizes=(10000, 100000, 1000000),
+                   queries=('rice', 'black beans', 'chicken spinach garlic',
+                            'slow cooker')):
+    """
+    Times full text searches against archives of several sizes, and a
+    LIKE scan over the same columns for comparison.
+
+    :param sizes: The amounts of stored recipes to test with.
+    :param queries: The searches to time.
+    :return: A list of dicts with the size and the seconds per search.
+    """
+
+    results = []
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            db = Database(os.path.join(directory, 'recipes.sqlite'))
+            fill_database(db, size)
+
+            def search_all():
+                for query in queries:
+                    db.search(query)
+
+            def scan_all():
+                for query in queries:
+                    sql = 'SELECT post_id FROM Recipes WHERE ' + \
+                          ' AND '.join('(title || ingredients || '
+                                       'instructions) LIKE ?'
+                                       for _ in query.split())
+                    db.cursor.execute(sql, ['%' + word + '%' for word in
+                                            query.split()]).fetchall()
+
+            results.append({
+                'size': size,
+                'search': time_call(search_all) / len(queries),
+                'scan': time_call(scan_all, repeat=1) / len(queries)})
+            db.close()
+    return results
+
+
+def pantry_lookup(sizes=(10000, 100000),
+                  pantries=(('rice', 'eggs'), ('black beans', 'onion',
+                                               'garlic', 'tortillas'),
+                            ('oats', 'bananas', 'yogurt', 'peanut butter',
+                             'eggs', 'spinach'))):
+    """
+    Times the ingredient coverage query against archives of several sizes,
+    and against ranking every stored recipe without the index.
+
+    :param sizes: The amounts of stored recipes to test with.
+    :param pantries: The sets of ingredients to look up.
+    :return: A list of dicts with the size and the seconds per lookup.
+    """
+
+    results = []
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            db = Database(os.path.join(directory, 'recipes.sqlite'))
+            fill_database(db, size)
+            db.rebuild_ingredient_index()
+
+            def find_all():
+                for pantry in pantries:
+                    db.find_by_ingredients(pantry)
+
+            def scan_all():
+                for pantry in pantries:
+                    wanted = set(map(canonicalize, pantry))
+                    scores = []
+                    for recipe in db.iter_all_recipes():
+                        names = set(map(canonicalize, recipe.ingredients))
+                        names.discard(None)
+                        scores.append((len(names & wanted) / len(names),
+                                       recipe.id))
+                    heapq.nlargest(20, scores)
+
+            results.append({
+                'size': size,
+                'index': time_call(find_all, repeat=1) / len(pantries),
+                'scan': time_call(scan_all, repeat=1) / len(pantries)})
+            db.close()
+    return results
+
+
+def bot_throughput(threads=200, comments=20, workers=(0, 4), latency=0.0,
+                   error_rate=0.0):
+    """
+    Times a whole run of the bot against the fake Reddit source, from
+    listing the threads to storing the recipes.
+
+    :param threads: How many threads the fake source serves.
+    :param comments: How many comments every thread has.
+    :param workers: The amounts of analysis processes to test with.
+    :param latency: How many seconds every fake request takes.
+    :param error_rate: The share of fake requests that fail.
+    :return: A list of dicts with the amount of workers, the seconds taken,
+    and the threads and posts checked per second.
+    """
+
+    titles = Synthetic.load_titles()
+    results = []
+    for worker_count in workers:
+        source = FakeSource(threads, comments, latency=latency,
+                            error_rate=error_rate, titles=titles)
+        # The fake server has no rate limit to respect.
+        fetcher = Fetcher(source, rate=UNLIMITED_RATE, burst=UNLIMITED_RATE,
+                          base_delay=0.01)
+        with tempfile.TemporaryDirectory() as directory:
+            db = Database(os.path.join(directory, 'recipes.sqlite'))
+            bot = RedditAPI(source, db, worker_count, fetcher=fetcher)
+            seconds = time_call(bot.run_bot, repeat=1)
+            bot.close()
+        results.append({'workers': worker_count, 'seconds': seconds,
+                        'threads': threads / seconds,
+                        'posts': threads * (comments + 1) / seconds})
+    return results
+
+
+def thread_memory(sizes=(1000, 5000)):
+    """
+    Measures the peak memory and time of checking a single thread with
+    several amounts of comments, which the comment buffer should keep from
+    growing with the thread.
+
+    :param sizes: The amounts of comments to test with.
+    :return: A list of dicts with the size, the seconds taken and the peak
+    bytes.
+    """
+
+    titles = Synthetic.load_titles()
+    # Loaded up front, so it does not count towards the first peak.
+    Analyzer.get_title_index()
+    results = []
+    for size in sizes:
+        source = FakeSource(1, size, titles=titles)
+        fetcher = Fetcher(source, rate=UNLIMITED_RATE, burst=UNLIMITED_RATE)
+        with tempfile.TemporaryDirectory() as directory:
+            db = Database(os.path.join(directory, 'recipes.sqlite'))
+            bot = RedditAPI(source, db, 0, fetcher=fetcher)
+            start = perf_counter()
+            peak = peak_memory(bot.check_thread, source.submissions[0])
+            seconds = perf_counter() - start
+            bot.close()
+        results.append({'size': size, 'seconds': seconds, 'peak': peak})
+    return results
+
+
+def run_suite(quick=False):
+    """
+    Runs every benchmark on a fixed synthetic corpus, printing each result
+    as it comes in.
+
+    :param quick: Use small databases and corpora, for a run of a minute or
+    two instead of a long one.
+    :return: An OrderedDict of benchmark name to its results.
+    """
+
+    sizes = QUICK_SIZES if quick else SIZES
+    results = OrderedDict()
+
+    result = results['startup'] = startup_time()
+    print('Startup: import {import:.3f}s, title index {cold:.3f}s cold, '
+          '{warm:.3f}s from the cache'.format(**result))
+
+    posts = Synthetic.make_posts(10 if quick else 50)
+    result = results['title_matching'] = compare_title_matching(
+        [' '.join(post) for post in posts])
+    print('Title matching: {0:.1%} agreement, indexed {1:.2f}s, '
+          'exhaustive {2:.2f}s'.format(result['agreement'],
+                                       result['indexed_seconds'],
+                                       result['scan_seconds']))
+
+    posts = Synthetic.make_posts(500 if quick else 2000)
+    result = results['title_throughput'] = title_throughput(
+        [' '.join(post) for post in posts])
+    print('Title throughput: {0:.0f} posts/s per post, {1:.0f} posts/s '
+          'batched'.format(result['per_post'], result['batch']))
+
+    result = results['section_parsing'] = section_parsing(
+        [post[1] for post in posts])
+    print('Section parsing: {separate:.3f}s separately, {single_pass:.3f}s '
+          'in a single pass, agree: {agree}, known cases: '
+          '{cases}'.format(**result))
+
+    result = results['type_detection'] = type_detection(
+        [Analyzer.clean_up(' '.join(post)) for post in posts])
+    print('Type detection: {per_second:.0f} texts/s'.format(**result))
+
+    results['inserts'] = insert_throughput(1000 if quick else 5000)
+    for result in results['inserts']:
+        print('Inserts in batches of {batch_size}: {per_second:.0f} '
+              'recipes/s'.format(**result))
+
+    results['weekly_queries'] = query_latency(sizes)
+    for result in results['weekly_queries']:
+        print('{size} rows: weekly {weekly:.4f}s ({weekly_unindexed:.4f}s '
+              'unindexed), author {author:.4f}s ({author_unindexed:.4f}s '
+              'unindexed)'.format(**result))
+
+    results['export_memory'] = export_memory(sizes[:2])
+    for result in results['export_memory']:
+        print('Exporting {size} rows: {streaming} bytes peak streaming, '
+              '{list} bytes peak as a list'.format(**result))
+
+    result = results['recipe_footprint'] = recipe_footprint()
+    print('Recipe footprint: {dict:.0f} bytes with a __dict__, {slots:.0f} '
+          'bytes with __slots__'.format(**result))
+
+    week_size = 10000 if quick else 50000
+    results['digest'] = digest_cost(week_size)
+    for name, result in sorted(results['digest'].items()):
+        print('Digest of {0} recipes ({1}): {seconds:.2f}s, {peak} bytes '
+              'peak'.format(week_size, name, **result))
+
+    results['duplicate_lookup'] = duplicate_lookup(sizes)
+    for result in results['duplicate_lookup']:
+        print('Near duplicate lookup against {size} recipes: {lookup:.5f}s '
+              'per recipe, {found:.0%} of copies found'.format(**result))
+
+    results['search'] = search_latency(sizes)
+    for result in results['search']:
+        print('Search over {size} recipes: {search:.4f}s per query '
+              '({scan:.4f}s with LIKE)'.format(**result))
+
+    results['pantry_lookup'] = pantry_lookup(sizes[:2])
+    for result in results['pantry_lookup']:
+        print('Pantry lookup over {size} recipes: {index:.4f}s per lookup '
+              '({scan:.4f}s without the index)'.format(**result))
+
+    results['bot_run'] = bot_throughput(50 if quick else 200)
+    for result in results['bot_run']:
+        print('Bot run with {workers} workers: {seconds:.2f}s, {threads:.1f} '
+              'threads/s, {posts:.0f} posts/s'.format(**result))
+
+    results['fetch_concurrency'] = fetch_concurrency(50 if quick else 100)
+    for result in results['fetch_concurrency']:
+        print('Expanding threads with {workers} in flight: {seconds:.2f}s, '
+              '{threads:.1f} threads/s, {failed} failed'.format(**result))
+
+    results['thread_memory'] = thread_memory((500, 2000) if quick else
+                                             (1000, 5000))
+    for result in results['thread_memory']:
+        print('Checking a thread of {size} comments: {seconds:.2f}s, {peak} '
+              'bytes peak'.format(**result))
+
+    return results
+
+
+def get_measurements(results, prefix=''):
+    """
+    Flattens nested benchmark results into dotted names and numbers, e.g.
+    'weekly_queries.10000.weekly'. Lists of results are keyed by the size,
+    batch size or workers they were measured with.
+
+    :param results: The results, as returned by run_suite.
+    :param prefix: The name of the results so far.
+    :return: A generator of (name, number) tuples.
+    """
+
+    if isinstance(results, dict):
+        for key, value in results.items():
+            for measurement in get_measurements(value, prefix + str(key) +
+                                                '.'):
+                yield measurement
+    elif isinstance(results, (list, tuple)):
+        for index, value in enumerate(results):
+            for key in LIST_KEYS:
+                if isinstance(value, dict) and key in value:
+                    index = value[key]
+                    break
+            for measurement in get_measurements(value, prefix + str(index) +
+                                                '.'):
+                yield measurement
+    elif isinstance(results, (int, float)) and not isinstance(results, bool):
+        yield prefix[:-1], results
+
+
+def compare_results(old_results, new_results):
+    """Prints how every measurement changed between two runs.
+
+    :param old_results: The results of the earlier run.
+    :param new_results: The results of the later run.
+    """
+
+    old = dict(get_measurements(old_results))
+    for name, value in get_measurements(new_results):
+        if name in old and old[name]:
+            print('{0}: {1:.4g} -> {2:.4g} ({3:+.1%})'.format(
+                name, old[name], value, value / old[name] - 1))
+
+
+def fetch_concurrency(threads=100, latency=0.05, error_rate=0.1,
+                      workers=(1, 4, 8)):
+    """
+    Times expanding the comment trees of every thread of a slow, failing
+    fake server with several amounts of expansions in flight.
+
+    :param threads: How many threads the fake source serves.
+    :param latency: How many seconds every fake request takes.
+    :param error_rate: The share of fake requests that fail.
+    :param workers: The amounts of expansions in flight to test with.
+    :return: A list of dicts with the amount of workers, the seconds taken,
+    the threads expanded per second and the threads that failed for good.
+    """
+
+    titles = Synthetic.load_titles()
+    results = []
+    for worker_count in workers:
+        source = FakeSource(threads, latency=latency, error_rate=error_rate,
+                            titles=titles)
+        fetcher = Fetcher(source, worker_count, rate=UNLIMITED_RATE,
+                          burst=UNLIMITED_RATE, base_delay=latency)
+        failed = 0
+        start = perf_counter()
+        for submission in fetcher.prefetch_comments(source.submissions):
+            try:
+                for _ in fetcher.iter_comments(submission):
+                    pass
+            except SourceError:
+                failed += 1
+        seconds = perf_counter() - start
+        fetcher.close()
+        results.append({'workers': worker_count, 'seconds': seconds,
+                        'threads': threads / seconds, 'failed': failed})
+    return results
+
+
+def main(argv=None):
+    """Runs the benchmarks, optionally saving and comparing the results."""
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark the bot on synthetic data.')
+    parser.add_argument('--quick', action='store_true',
+                        help='use small databases and corpora')
+    parser.add_argument('--output', metavar='JSON',
+                        help='save the results to this file')
+    parser.add_argument('--compare', metavar='JSON',
+                        help='compare the results to an earlier saved run')
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.quick)
+
+    if args.output is not None:
+        with open(args.output, 'w') as output:
+            json.dump({'time': int(time()), 'python': sys.version,
+                       'quick': args.quick, 'results': results}, output,
+                      indent=2)
+    if args.compare is not None:
+        with open(args.compare) as earlier:
+            print('Compared to', args.compare)
+            compare_results(json.load(earlier)['results'], results)
+
+
+if __name__ == '__main__':
+    main()
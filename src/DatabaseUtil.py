@@ -1,34 +1,401 @@
 """Basic CRUD and Data Analysis of Recipes"""
 
+import heapq
+import re
 import sqlite3
+from collections import Counter
 from time import time
-from src.Recipe import Recipe, PostInfo, RefinedPost
+from src.IngredientIndex import canonicalize, get_ingredients
+from src.Metrics import metrics
+from src.NearDuplicate import MinHasher, get_shingles, get_similarity, \
+    pack_signature, unpack_signature, MIN_SHINGLES, SIMILARITY_THRESHOLD
+from src.Recipe import Recipe, PostInfo, RawPost
+
+DATABASE_PATH = '../DDL Files/recipes_db.sqlite'
+RECIPE_COLUMNS = 'post_id, author, karma, url, title, ingredients, ' \
+                 'instructions, type, time'
+FETCH_SIZE = 500
+QUERY_CHUNK_SIZE = 500
+MAX_DUPLICATE_CANDIDATES = 200
+SEARCH_LIMIT = 20
+# Title matches weigh the most in the ranking, then ingredients.
+SEARCH_WEIGHTS = (10.0, 2.0, 1.0)
+PANTRY_LIMIT = 20
+
+_escape = re.compile(r'[\\;]')
+_unescape = re.compile(r'\\(.)')
+_value = re.compile(r'((?:[^\\;]|\\.)*)(;?)')
+
+
+def join_values(values):
+    """
+    Joins lines into a semi-colon separated string, escaping semi-colons and
+    backslashes inside the lines.
+    """
+
+    return ';'.join(_escape.sub(r'\\\g<0>', value) for value in values)
+
+
+def split_values(text):
+    """Splits a string made by join_values back into its lines."""
+
+    if '\\' not in text:
+        return text.split(';')
+    values = []
+    for match in _value.finditer(text):
+        values.append(_unescape.sub(r'\1', match.group(1)))
+        if not match.group(2):
+            break
+    return values
+
+
+def create_recipes_table(cursor):
+    """Creates the Recipes table, which older databases already have."""
+
+    cursor.execute('CREATE TABLE IF NOT EXISTS Recipes ('
+                   'post_id TEXT PRIMARY KEY,'
+                   'author TEXT,'
+                   'karma INTEGER,'
+                   'url TEXT,'
+                   'title TEXT,'
+                   'ingredients TEXT,'
+                   'instructions TEXT,'
+                   'type TEXT,'
+                   'time INTEGER)')
+
+
+def create_seen_submissions_table(cursor):
+    """
+    Creates the table of scanned submission ids, with the time each
+    submission was posted. Ids imported from the old text file have the
+    time they were imported instead.
+    """
+
+    cursor.execute('CREATE TABLE IF NOT EXISTS SeenSubmissions ('
+                   'submission_id TEXT PRIMARY KEY,'
+                   'time INTEGER)')
+
+
+def create_query_indexes(cursor):
+    """
+    Indexes the columns the weekly and per author queries filter on, so
+    they no longer scan the whole table.
+    """
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS Recipes_time '
+                   'ON Recipes (time)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS Recipes_author '
+                   'ON Recipes (author)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS Recipes_time_karma '
+                   'ON Recipes (time, karma)')
+
+
+def create_analysis_cache_table(cursor):
+    """Creates the table of cached analysis results."""
+
+    cursor.execute('CREATE TABLE IF NOT EXISTS AnalysisCache ('
+                   'key TEXT PRIMARY KEY,'
+                   'is_recipe INTEGER,'
+                   'title TEXT,'
+                   'ingredients TEXT,'
+                   'instructions TEXT,'
+                   'last_used INTEGER)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS AnalysisCache_last_used '
+                   'ON AnalysisCache (last_used)')
+
+
+def create_near_duplicate_index(cursor):
+    """
+    Creates the MinHash signature and LSH band tables used to spot copied
+    recipes, and fills them for the recipes already stored.
+    """
+
+    cursor.execute('ALTER TABLE Recipes ADD COLUMN duplicate_of TEXT')
+    cursor.execute('CREATE TABLE IF NOT EXISTS RecipeSignatures ('
+                   'post_id TEXT PRIMARY KEY,'
+                   'signature BLOB)')
+    cursor.execute('CREATE TABLE IF NOT EXISTS RecipeBands ('
+                   'bucket INTEGER,'
+                   'band INTEGER,'
+                   'post_id TEXT)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS RecipeBands_bucket '
+                   'ON RecipeBands (bucket)')
+
+    hasher = MinHasher()
+    # Read through a cursor of its own, a chunk at a time, while the
+    # signatures are written through the other one.
+    rows = cursor.connection.execute('SELECT post_id, ingredients, '
+                                     'instructions FROM Recipes')
+    while True:
+        chunk = rows.fetchmany(FETCH_SIZE)
+        if not chunk:
+            break
+        signatures = []
+        for post_id, ingredients, instructions in chunk:
+            shingles = get_shingles((ingredients or '').split(';'),
+                                    (instructions or '').split(';'))
+            if len(shingles) >= MIN_SHINGLES:
+                signatures.append((post_id,
+                                   hasher.get_signature(shingles)))
+        cursor.executemany('INSERT INTO RecipeSignatures VALUES(?, ?)',
+                           [(post_id, pack_signature(signature))
+                            for post_id, signature in signatures])
+        cursor.executemany('INSERT INTO RecipeBands VALUES(?, ?, ?)',
+                           [(bucket, band, post_id)
+                            for post_id, signature in signatures
+                            for band, bucket in
+                            hasher.get_buckets(signature)])
+
+
+def create_search_index(cursor):
+    """
+    Creates a full text search index over the titles, ingredients and
+    instructions of the recipes, kept in sync with Recipes by triggers,
+    and fills it with the recipes already stored.
+    """
+
+    cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS RecipesSearch "
+                   "USING fts5(title, ingredients, instructions, "
+                   "content='Recipes', content_rowid='rowid')")
+    cursor.execute('CREATE TRIGGER IF NOT EXISTS Recipes_search_insert '
+                   'AFTER INSERT ON Recipes BEGIN '
+                   'INSERT INTO RecipesSearch '
+                   '(rowid, title, ingredients, instructions) '
+                   'VALUES (new.rowid, new.title, new.ingredients, '
+                   'new.instructions); END')
+    cursor.execute("CREATE TRIGGER IF NOT EXISTS Recipes_search_delete "
+                   "AFTER DELETE ON Recipes BEGIN "
+                   "INSERT INTO RecipesSearch "
+                   "(RecipesSearch, rowid, title, ingredients, instructions) "
+                   "VALUES ('delete', old.rowid, old.title, old.ingredients, "
+                   "old.instructions); END")
+    cursor.execute("CREATE TRIGGER IF NOT EXISTS Recipes_search_update "
+                   "AFTER UPDATE ON Recipes BEGIN "
+                   "INSERT INTO RecipesSearch "
+                   "(RecipesSearch, rowid, title, ingredients, instructions) "
+                   "VALUES ('delete', old.rowid, old.title, old.ingredients, "
+                   "old.instructions); "
+                   "INSERT INTO RecipesSearch "
+                   "(rowid, title, ingredients, instructions) "
+                   "VALUES (new.rowid, new.title, new.ingredients, "
+                   "new.instructions); END")
+    rebuild_search_index(cursor)
+
+
+def rebuild_search_index(cursor):
+    """Refills the whole full text search index from Recipes in bulk."""
+
+    cursor.execute("INSERT INTO RecipesSearch (RecipesSearch) "
+                   "VALUES ('rebuild')")
+
+
+def reencode_legacy_values(cursor):
+    """
+    Rewrites the ingredients and instructions stored before join_values
+    escaped them, when they were joined with plain semi-colons. Only rows
+    with a backslash change: split_values would drop their backslashes.
+    """
+
+    def reencode(text):
+        return join_values(text.split(';')) if text is not None else None
+
+    rows = cursor.connection.cursor().execute(
+        "SELECT post_id, ingredients, instructions FROM Recipes "
+        "WHERE instr(ingredients, '\\') OR instr(instructions, '\\')")
+    while True:
+        chunk = rows.fetchmany(FETCH_SIZE)
+        if not chunk:
+            break
+        cursor.executemany('UPDATE Recipes SET ingredients = ?, '
+                           'instructions = ? WHERE post_id = ?',
+                           [(reencode(ingredients), reencode(instructions),
+                             post_id)
+                            for post_id, ingredients, instructions in chunk])
+
+
+def create_ingredient_index(cursor):
+    """
+    Creates the table of ingredient lines and the inverted index of
+    canonical ingredients to the recipes using them, and fills both for the
+    recipes already stored.
+
+    The escaped encoding of join_values came with this migration, so the
+    rows stored before it are re-encoded first.
+    """
+
+    reencode_legacy_values(cursor)
+
+    cursor.execute('CREATE TABLE IF NOT EXISTS RecipeIngredients ('
+                   'post_id TEXT,'
+                   'position INTEGER,'
+                   'line TEXT,'
+                   'ingredient TEXT,'
+                   'PRIMARY KEY (post_id, position)) WITHOUT ROWID')
+    # Clustered by ingredient, so a posting list is read in one range scan.
+    cursor.execute('CREATE TABLE IF NOT EXISTS IngredientPostings ('
+                   'ingredient TEXT,'
+                   'post_id TEXT,'
+                   'ingredient_count INTEGER,'
+                   'PRIMARY KEY (ingredient, post_id)) WITHOUT ROWID')
+    rebuild_ingredient_index(cursor)
+
+
+def rebuild_ingredient_index(cursor):
+    """Refills the ingredient tables from the Recipes table in bulk."""
+
+    cursor.execute('DELETE FROM RecipeIngredients')
+    cursor.execute('DELETE FROM IngredientPostings')
+    rows = cursor.connection.cursor().execute(
+        'SELECT post_id, ingredients, duplicate_of FROM Recipes')
+    while True:
+        chunk = rows.fetchmany(FETCH_SIZE)
+        if not chunk:
+            break
+        index_ingredients(cursor,
+                          [(post_id, split_values(ingredients or ''),
+                            original is not None)
+                           for post_id, ingredients, original in chunk])
+
+
+def index_ingredients(cursor, recipes):
+    """Stores the ingredient lines and postings of several recipes.
+
+    :param cursor: The cursor to write with.
+    :param recipes: (post_id, ingredient lines, is_duplicate) tuples. Near
+    duplicates get no postings, so they don't crowd out the originals.
+    """
+
+    line_rows = []
+    posting_rows = []
+    for post_id, lines, is_duplicate in recipes:
+        found = get_ingredients(lines)
+        line_rows.extend((post_id, position, line, ingredient)
+                         for position, line, ingredient in found)
+        if not is_duplicate:
+            names = set(ingredient for _, _, ingredient in found
+                        if ingredient is not None)
+            posting_rows.extend((ingredient, post_id, len(names))
+                                for ingredient in names)
+
+    cursor.executemany('INSERT OR IGNORE INTO RecipeIngredients '
+                       'VALUES(?, ?, ?, ?)', line_rows)
+    cursor.executemany('INSERT OR IGNORE INTO IngredientPostings '
+                       'VALUES(?, ?, ?)', posting_rows)
+
+
+def create_backfill_progress_table(cursor):
+    """Creates the table of how far each dump file has been imported."""
+
+    cursor.execute('CREATE TABLE IF NOT EXISTS BackfillProgress ('
+                   'path TEXT PRIMARY KEY,'
+                   'line INTEGER,'
+                   'finished INTEGER)')
+
+
+def create_bot_state_table(cursor):
+    """Creates the table of named timestamps the scheduler keeps."""
+
+    cursor.execute('CREATE TABLE IF NOT EXISTS BotState ('
+                   'name TEXT PRIMARY KEY,'
+                   'value REAL)')
+
+
+def create_thread_progress_tables(cursor):
+    """
+    Creates the tables of the threads the bot is partway through: how many
+    of their posts were checked, and the posts themselves, so a restarted
+    bot can carry on without fetching the thread again.
+    """
+
+    cursor.execute('CREATE TABLE IF NOT EXISTS ThreadProgress ('
+                   'submission_id TEXT PRIMARY KEY,'
+                   'position INTEGER,'
+                   'type TEXT,'
+                   'time INTEGER)')
+    cursor.execute('CREATE TABLE IF NOT EXISTS ThreadPosts ('
+                   'submission_id TEXT,'
+                   'position INTEGER,'
+                   'author TEXT,'
+                   'karma INTEGER,'
+                   'time INTEGER,'
+                   'post_id TEXT,'
+                   'url TEXT,'
+                   'title TEXT,'
+                   'content TEXT,'
+                   'PRIMARY KEY (submission_id, position)) WITHOUT ROWID')
+
+
+def add_thread_fetch_state(cursor):
+    """
+    Records whether all posts of a started thread were stored, now that
+    threads are stored while they are still being fetched.
+    """
+
+    cursor.execute('ALTER TABLE ThreadProgress '
+                   'ADD COLUMN complete INTEGER NOT NULL DEFAULT 1')
+
+
+def add_backfill_offset(cursor):
+    """
+    Records the decompressed byte offset each dump file was imported up
+    to, so resumed imports can seek there.
+    """
+
+    cursor.execute('ALTER TABLE BackfillProgress '
+                   'ADD COLUMN byte_offset INTEGER NOT NULL DEFAULT 0')
+
+
+# Applied in order; the database's user_version records how many of these
+# have already run. Only ever append to this list.
+MIGRATIONS = [create_recipes_table,
+              create_seen_submissions_table,
+              create_query_indexes,
+              create_analysis_cache_table,
+              create_near_duplicate_index,
+              create_search_index,
+              create_ingredient_index,
+              create_backfill_progress_table,
+              create_bot_state_table,
+              create_thread_progress_tables,
+              add_thread_fetch_state,
+              add_backfill_offset]
 
 
 class Database:
     """Class that handles all database operations."""
 
-    def __init__(self):
-        self.connection = sqlite3.connect('../DDL Files/recipes_db.sqlite')
+    def __init__(self, path=DATABASE_PATH):
+        """
+        :param path: The SQLite database file to use.
+        """
+
+        self.connection = sqlite3.connect(path)
         self.cursor = self.connection.cursor()
-        self.create_table()
-
-    def create_table(self):
-        """Creates the database if one has not been created."""
-
-        try:
-            self.cursor.execute('CREATE TABLE IF NOT EXISTS Recipes ('
-                                'post_id TEXT PRIMARY KEY,'
-                                'author TEXT,'
-                                'karma INTEGER,'
-                                'url TEXT,'
-                                'title TEXT,'
-                                'ingredients TEXT,'
-                                'instructions TEXT,'
-                                'type TEXT,'
-                                'time INTEGER)')
-        except sqlite3.OperationalError:
-            pass
+        # Readers no longer block the writer, and commits are cheaper.
+        self.cursor.execute('PRAGMA journal_mode=WAL')
+        self.hasher = MinHasher()
+        self.migrate()
+
+    def migrate(self):
+        """
+        Brings the schema of the database up to date, creating it if the
+        database is new. Each migration runs in its own transaction.
+        """
+
+        version = self.cursor.execute('PRAGMA user_version').fetchone()[0]
+
+        for version, migration in enumerate(MIGRATIONS[version:],
+                                            start=version + 1):
+            self.cursor.execute('BEGIN')
+            try:
+                migration(self.cursor)
+                self.cursor.execute('PRAGMA user_version = {0}'.format(
+                    version))
+                self.connection.commit()
+            except sqlite3.Error:
+                self.connection.rollback()
+                raise
+            print('Upgraded the database to version', version)
 
     def add(self, recipe):
         """Calls a query to add a new row to the recipe database.
@@ -36,58 +403,504 @@ class Database:
         :param recipe The recipe to insert into the database.
         """
 
-        post_id = recipe.id
-        author = recipe.author
-        karma = recipe.karma
-        url = recipe.url
-        title = recipe.title
-        ingredients = self.get_csv(recipe.ingredients)
-        instructions = self.get_csv(recipe.instructions)
-        recipe_type = recipe.type
-        time_posted = recipe.time
-
-        sql = 'INSERT INTO Recipes VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)'
-        values = [post_id, author, karma, url, title, ingredients,
-                  instructions, recipe_type, time_posted]
-        try:
-            self.cursor.execute(sql, values)
-            self.connection.commit()
-        except sqlite3.IntegrityError:
-            print('Already recorded that recipe!')
+        self.add_many([recipe])
 
-    def get_last_weeks_recipes(self):
-        """Retrieves a list of recipes from this past week"""
+    def add_many(self, recipes, progress=None):
+        """Adds a batch of recipes to the database in a single transaction.
+
+        Recipes that were already recorded are skipped. Recipes that are
+        near duplicates of an earlier one are stored, but flagged with the
+        id of the earlier recipe in duplicate_of.
+
+        :param recipes: The recipes to insert into the database.
+        :param progress: A (submission_id, position, recipe_type) tuple of
+        how far into its thread the bot got, committed together with the
+        recipes. The recipes stored earlier from the thread are retyped if
+        the type changed.
+        :return: The amount of recipes that were new.
+        """
+
+        existing = self.get_existing_ids([recipe.id for recipe in recipes])
+        new_recipes = []
+        for recipe in recipes:
+            if recipe.id not in existing:
+                existing.add(recipe.id)
+                new_recipes.append(recipe)
+
+        signatures, duplicates = self.find_near_duplicates(new_recipes)
+
+        sql = 'INSERT OR IGNORE INTO Recipes (' + RECIPE_COLUMNS + \
+              ', duplicate_of) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+        rows = [(recipe.id, recipe.author, recipe.karma, recipe.url,
+                 recipe.title, self.get_csv(recipe.ingredients),
+                 self.get_csv(recipe.instructions), recipe.type, recipe.time,
+                 duplicates.get(recipe.id))
+                for recipe in new_recipes]
+
+        with metrics.time('db_write'), self.connection:
+            self.cursor.executemany(sql, rows)
+            added = self.cursor.rowcount
+            self.cursor.executemany(
+                'INSERT OR IGNORE INTO RecipeSignatures VALUES(?, ?)',
+                [(post_id, pack_signature(signature))
+                 for post_id, (signature, _) in signatures.items()])
+            self.cursor.executemany(
+                'INSERT INTO RecipeBands VALUES(?, ?, ?)',
+                [(bucket, band, post_id)
+                 for post_id, (_, buckets) in signatures.items()
+                 for band, bucket in buckets])
+            index_ingredients(self.cursor,
+                              [(recipe.id, recipe.ingredients,
+                                recipe.id in duplicates)
+                               for recipe in new_recipes])
+            if progress is not None:
+                self.update_thread_progress(*progress)
+
+        metrics.count('recipes_stored', added)
+        metrics.count('duplicates_flagged', len(duplicates))
+        if added < len(recipes):
+            print('Already recorded', len(recipes) - added,
+                  'of those recipes!')
+        if duplicates:
+            print('Flagged', len(duplicates), 'near duplicate recipes.')
+        return added
+
+    def get_existing_ids(self, post_ids):
+        """Finds which of the given ids are already in the database.
+
+        :param post_ids: The ids to look for.
+        :return: The set of ids that are stored.
+        """
+
+        existing = set()
+        for start in range(0, len(post_ids), QUERY_CHUNK_SIZE):
+            chunk = post_ids[start:start + QUERY_CHUNK_SIZE]
+            sql = 'SELECT post_id FROM Recipes WHERE post_id IN ({0})'.format(
+                ', '.join('?' * len(chunk)))
+            existing.update(row[0] for row in self.cursor.execute(sql, chunk))
+        return existing
+
+    def find_near_duplicates(self, recipes):
+        """
+        Looks up every recipe in the LSH index, and compares it against the
+        stored recipes and the earlier recipes of the batch that share a
+        bucket with it.
+
+        :param recipes: The new recipes, in the order they will be stored.
+        :return: A dict of post id to (signature, buckets) for every recipe
+        long enough to be indexed, and a dict of post id to the id of the
+        original recipe for every near duplicate.
+        """
+
+        signatures = {}
+        duplicates = {}
+        batch_buckets = {}
+
+        for recipe in recipes:
+            shingles = get_shingles(recipe.ingredients, recipe.instructions)
+            if len(shingles) < MIN_SHINGLES:
+                continue
+            signature = self.hasher.get_signature(shingles)
+            buckets = self.hasher.get_buckets(signature)
+
+            candidates = self.get_stored_candidates(buckets)
+            for bucket in buckets:
+                for post_id in batch_buckets.get(bucket, ()):
+                    candidates[post_id] = (signatures[post_id][0],
+                                           duplicates.get(post_id))
+
+            best_similarity = SIMILARITY_THRESHOLD
+            for post_id, (other_signature, original) in candidates.items():
+                similarity = get_similarity(signature, other_signature)
+                if similarity >= best_similarity:
+                    best_similarity = similarity
+                    duplicates[recipe.id] = original or post_id
+
+            signatures[recipe.id] = (signature, buckets)
+            for bucket in buckets:
+                batch_buckets.setdefault(bucket, []).append(recipe.id)
+
+        return signatures, duplicates
+
+    def get_stored_candidates(self, buckets):
+        """
+        Finds stored recipes sharing at least one LSH bucket. When there are
+        more than MAX_DUPLICATE_CANDIDATES, the ones sharing the most bands
+        are kept, since those are the most likely to be copies.
+
+        :param buckets: The (band, bucket) tuples of the new recipe.
+        :return: A dict of post id to (signature, duplicate_of).
+        """
+
+        wanted = set(buckets)
+        sql = 'SELECT band, bucket, post_id FROM RecipeBands ' \
+              'WHERE bucket IN ({0})'.format(', '.join('?' * len(buckets)))
+        shared_bands = Counter(
+            post_id for band, bucket, post_id in self.cursor.execute(
+                sql, [bucket for _, bucket in buckets])
+            if (band, bucket) in wanted)
+        post_ids = [post_id for post_id, _ in
+                    shared_bands.most_common(MAX_DUPLICATE_CANDIDATES)]
+
+        if not post_ids:
+            return {}
+
+        sql = 'SELECT s.post_id, s.signature, r.duplicate_of ' \
+              'FROM RecipeSignatures s JOIN Recipes r USING (post_id) ' \
+              'WHERE s.post_id IN ({0})'.format(', '.join('?' * len(post_ids)))
+        return dict((post_id, (unpack_signature(signature), original))
+                    for post_id, signature, original in
+                    self.cursor.execute(sql, post_ids))
+
+    def close(self):
+        """Closes the connection to the database."""
+
+        self.connection.close()
+
+    def get_state(self, name):
+        """Reads a value the bot keeps between runs.
+
+        :param name: The name of the value.
+        :return: The value, or None if it was never set.
+        """
+
+        row = self.cursor.execute('SELECT value FROM BotState WHERE name = ?',
+                                  [name]).fetchone()
+        return row[0] if row is not None else None
+
+    def set_state(self, name, value):
+        """Stores a value the bot keeps between runs.
+
+        :param name: The name of the value.
+        :param value: The number to store.
+        """
+
+        with self.connection:
+            self.cursor.execute('INSERT OR REPLACE INTO BotState '
+                                'VALUES(?, ?)', [name, value])
+
+    def start_thread(self, submission_id):
+        """
+        Records that the bot started on a thread, which is stored as it is
+        fetched so the bot can carry on where it stopped if interrupted.
+
+        :param submission_id: The id of the thread's submission.
+        """
+
+        with self.connection:
+            self.cursor.execute('INSERT OR REPLACE INTO ThreadProgress '
+                                'VALUES(?, 0, NULL, ?, 0)',
+                                [submission_id, int(time())])
+            self.cursor.execute('DELETE FROM ThreadPosts '
+                                'WHERE submission_id = ?', [submission_id])
+
+    def add_thread_posts(self, submission_id, start, raw_posts):
+        """Stores the next fetched posts of a started thread.
+
+        :param submission_id: The id of the thread's submission.
+        :param start: The position of the first of the posts.
+        :param raw_posts: The RawPosts, in the order they are checked.
+        """
+
+        with self.connection:
+            self.cursor.executemany(
+                'INSERT OR REPLACE INTO ThreadPosts '
+                'VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(submission_id, position, raw_post.post_info.author,
+                  raw_post.post_info.karma, raw_post.post_info.time,
+                  raw_post.post_info.id, raw_post.post_info.link,
+                  raw_post.title, raw_post.content)
+                 for position, raw_post in enumerate(raw_posts, start)])
+
+    def update_thread_progress(self, submission_id, position, recipe_type):
+        """
+        Records how far the bot got into a started thread, within the
+        transaction of the recipes found up to there. If the type of the
+        thread changed, its recipes stored before are given the new one.
+
+        :param submission_id: The id of the thread's submission.
+        :param position: The position of the next post to check.
+        :param recipe_type: The type of the thread's recipes so far.
+        """
+
+        row = self.cursor.execute('SELECT type FROM ThreadProgress '
+                                  'WHERE submission_id = ?',
+                                  [submission_id]).fetchone()
+        if row is not None and row[0] != recipe_type:
+            self.cursor.execute('UPDATE Recipes SET type = ? WHERE post_id '
+                                'IN (SELECT post_id FROM ThreadPosts '
+                                'WHERE submission_id = ?)',
+                                [recipe_type, submission_id])
+        self.cursor.execute('UPDATE ThreadProgress SET position = ?, '
+                            'type = ?, time = ? WHERE submission_id = ?',
+                            [position, recipe_type, int(time()),
+                             submission_id])
+
+    def finish_thread(self, submission_id):
+        """
+        Records that all posts of a started thread were stored. Its recipes
+        already have the type of the whole thread by then.
+
+        :param submission_id: The id of the thread's submission.
+        """
+
+        with self.connection:
+            self.cursor.execute('UPDATE ThreadProgress SET complete = 1 '
+                                'WHERE submission_id = ?', [submission_id])
+
+    def get_thread_progress(self, submission_id):
+        """Looks up how far the bot got into a thread.
+
+        :param submission_id: The id of the thread's submission.
+        :return: A (position, recipe_type, complete) tuple, or None if the
+        thread was not started. The type goes by the posts checked so far.
+        """
+
+        row = self.cursor.execute('SELECT position, type, complete FROM '
+                                  'ThreadProgress WHERE submission_id = ?',
+                                  [submission_id]).fetchone()
+        return (row[0], row[1], bool(row[2])) if row is not None else None
+
+    def count_thread_posts(self, submission_id):
+        """Counts the stored posts of a started thread."""
+
+        return self.cursor.execute('SELECT COUNT(*) FROM ThreadPosts '
+                                   'WHERE submission_id = ?',
+                                   [submission_id]).fetchone()[0]
+
+    def get_thread_post_ids(self, submission_id):
+        """Lists the ids of the stored posts of a started thread.
+
+        :param submission_id: The id of the thread's submission.
+        :return: A set of post ids.
+        """
+
+        return set(row[0] for row in self.connection.execute(
+            'SELECT post_id FROM ThreadPosts WHERE submission_id = ?',
+            [submission_id]))
+
+    def get_thread_posts(self, submission_id, start=0, limit=-1):
+        """Reads back stored posts of a started thread.
+
+        :param submission_id: The id of the thread's submission.
+        :param start: The position of the first post to read.
+        :param limit: How many posts to read at most, all if negative.
+        :return: A list of RawPosts, in the order they are checked.
+        """
+
+        cursor = self.connection.execute(
+            'SELECT author, karma, time, post_id, url, title, content '
+            'FROM ThreadPosts WHERE submission_id = ? AND position >= ? '
+            'ORDER BY position LIMIT ?', [submission_id, start, limit])
+        return [RawPost(PostInfo(*row[:5]), row[5], row[6])
+                for row in cursor]
+
+    def iter_thread_texts(self, submission_id):
+        """Reads the text of every stored post of a thread, one at a time.
+
+        :param submission_id: The id of the thread's submission.
+        :return: A generator of the titles and contents of the posts.
+        """
+
+        cursor = self.connection.execute(
+            'SELECT title, content FROM ThreadPosts '
+            'WHERE submission_id = ? ORDER BY position', [submission_id])
+        for title, content in cursor:
+            yield title + '\n' + content
+
+    def get_fetched_threads(self):
+        """Lists the started threads whose posts are all stored.
+
+        :return: A set of submission ids.
+        """
+
+        sql = 'SELECT submission_id FROM ThreadProgress WHERE complete = 1'
+        return set(row[0] for row in self.cursor.execute(sql))
+
+    def iter_recipes(self, where=None, params=(), order_by=None,
+                     limit=None):
+        """
+        Streams recipes matching a query, building each recipe only when it
+        is reached, so memory use does not grow with the amount of rows.
+
+        :param where: The SQL condition rows must match, if any.
+        :param params: The values for the placeholders in the condition.
+        :param order_by: The SQL ordering of the rows, if any.
+        :param limit: The maximum amount of recipes, if any.
+        :return: A generator of recipe objects.
+        """
+
+        sql = 'SELECT ' + RECIPE_COLUMNS + ' FROM Recipes'
+        params = list(params)
+        if where is not None:
+            sql += ' WHERE ' + where
+        if order_by is not None:
+            sql += ' ORDER BY ' + order_by
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+
+        # A cursor of its own, so other queries can run while this streams.
+        cursor = self.connection.cursor()
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                yield self.row_to_recipe(row)
+
+    def row_to_recipe(self, row):
+        """Creates a recipe object from a row of the Recipes table.
+
+        :param row: The row, with the columns in the order of RECIPE_COLUMNS.
+        :return: The recipe object.
+        """
+
+        post_id, author, karma, url, title, ingredients, instructions, \
+            recipe_type, time_posted = row
+
+        return Recipe.from_values(post_id, author, karma, url, title,
+                                  self.get_list_from_csv(ingredients),
+                                  self.get_list_from_csv(instructions),
+                                  recipe_type, time_posted)
 
-        recipe_list = []
+    def search(self, query, limit=SEARCH_LIMIT, include_duplicates=False):
+        """
+        Searches the titles, ingredients and instructions of all recipes,
+        best matches first by BM25 ranking.
+
+        :param query: The words to search for. Recipes have to contain all
+        of them.
+        :param limit: The maximum amount of recipes.
+        :param include_duplicates: Whether to include recipes flagged as
+        near duplicates of an earlier recipe.
+        :return: A list of recipe objects.
+        """
+
+        # Every word is quoted, so punctuation can't be taken for FTS5
+        # query syntax.
+        match = ' '.join('"{0}"'.format(word.replace('"', '""'))
+                         for word in query.split())
+        if not match:
+            return []
+
+        sql = 'SELECT ' + ', '.join('r.' + column.strip() for column in
+                                    RECIPE_COLUMNS.split(',')) + \
+              ' FROM RecipesSearch JOIN Recipes r ' \
+              'ON r.rowid = RecipesSearch.rowid ' \
+              'WHERE RecipesSearch MATCH ?'
+        if not include_duplicates:
+            sql += ' AND r.duplicate_of IS NULL'
+        sql += ' ORDER BY bm25(RecipesSearch, ?, ?, ?) LIMIT ?'
+
+        rows = self.connection.cursor().execute(
+            sql, [match] + list(SEARCH_WEIGHTS) + [limit])
+        return [self.row_to_recipe(row) for row in rows]
+
+    def rebuild_search_index(self):
+        """
+        Refills the full text search index from scratch. Only needed after
+        a VACUUM, which may renumber the rows the index points at.
+        """
+
+        with self.connection:
+            rebuild_search_index(self.cursor)
+
+    def find_by_ingredients(self, ingredients, limit=PANTRY_LIMIT,
+                            require_all=False):
+        """
+        Finds the recipes that can best be cooked with the given ingredients,
+        ranked by the share of their own ingredients that are covered.
+
+        :param ingredients: The ingredients at hand, e.g. ['rice', '2 eggs'].
+        :param limit: The maximum amount of recipes.
+        :param require_all: Whether recipes have to use every one of the
+        given ingredients.
+        :return: A list of (recipe, coverage) tuples, best first, where
+        coverage is the share of the recipe's ingredients that were given.
+        """
+
+        wanted = set(ingredient for ingredient in map(canonicalize,
+                                                      ingredients)
+                     if ingredient is not None)
+        if not wanted:
+            return []
+
+        postings = [self.get_posting_list(ingredient)
+                    for ingredient in wanted]
+        totals = {}
+        for posting in postings:
+            totals.update(posting)
+
+        if require_all:
+            # Smallest posting lists first, so the intersection shrinks fast.
+            postings.sort(key=len)
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                candidates.intersection_update(posting)
+            matched = dict.fromkeys(candidates, len(postings))
+        else:
+            # The given ingredients a recipe uses are the posting lists it
+            # is in.
+            matched = Counter()
+            for posting in postings:
+                matched.update(posting.keys())
+
+        best = heapq.nlargest(limit, ((count / totals[post_id], count, post_id)
+                                      for post_id, count in matched.items()))
+        if not best:
+            return []
+
+        recipes = dict((recipe.id, recipe) for recipe in self.iter_recipes(
+            'post_id IN ({0})'.format(', '.join('?' * len(best))),
+            [post_id for _, _, post_id in best]))
+        return [(recipes[post_id], coverage)
+                for coverage, _, post_id in best if post_id in recipes]
+
+    def get_posting_list(self, ingredient):
+        """Reads the recipes using a canonical ingredient.
+
+        :param ingredient: The canonical ingredient name.
+        :return: A dict of post id to the amount of distinct ingredients in
+        that recipe.
+        """
+
+        return dict(self.cursor.execute(
+            'SELECT post_id, ingredient_count FROM IngredientPostings '
+            'WHERE ingredient = ?', [ingredient]))
+
+    def rebuild_ingredient_index(self):
+        """
+        Refills the ingredient tables from scratch, e.g. after recipes were
+        loaded by other means or the canonical names changed.
+        """
+
+        with self.connection:
+            rebuild_ingredient_index(self.cursor)
+
+    def iter_last_weeks_recipes(self, order_by=None, limit=None,
+                                include_duplicates=False):
+        """Streams the recipes from this past week.
+
+        :param order_by: The SQL ordering of the recipes, if any.
+        :param limit: The maximum amount of recipes, if any.
+        :param include_duplicates: Whether to include recipes flagged as
+        near duplicates of an earlier recipe.
+        """
 
         yesterday = time() - 86400
         week_from_yesterday = yesterday - 604800
-        sql = 'SELECT * FROM Recipes WHERE time BETWEEN ? AND ?'
-        rows = self.cursor.execute(sql, [week_from_yesterday, yesterday]
-                                   ).fetchall()
+        where = 'time BETWEEN ? AND ?'
+        if not include_duplicates:
+            where += ' AND duplicate_of IS NULL'
+        return self.iter_recipes(where, [week_from_yesterday, yesterday],
+                                 order_by, limit)
 
-        for row in rows:
-            try:
-                post_id = row[0]
-                author = row[1]
-                karma = row[2]
-                url = row[3]
-                title = row[4]
-                ingredients = self.get_list_from_csv(row[5])
-                instructions = self.get_list_from_csv(row[6])
-                recipe_type = row[7]
-                time_posted = row[8]
-
-                post_info = PostInfo(author, karma, time_posted, post_id, url)
-                refined_post = RefinedPost(title, ingredients, instructions,
-                                           recipe_type)
-                recipe = Recipe(post_info, refined_post)
-                recipe_list.append(recipe)
-
-            except TypeError:
-                print('No recipes this past week!')
-
-        return recipe_list
+    def get_last_weeks_recipes(self):
+        """Retrieves a list of recipes from this past week"""
+
+        return list(self.iter_last_weeks_recipes())
 
     def get_recipes_from_author(self, author):
         """Retrieves a list of recipes posted by a certain redditor.
@@ -96,43 +909,23 @@ class Database:
         :return: The recipe object.
         """
 
-        recipe_list = []
+        return list(self.iter_recipes('author = ?', [author]))
 
-        sql = 'SELECT * FROM Recipes WHERE author = ?'
-        rows = self.cursor.execute(sql, [author]).fetchall()
+    def iter_all_recipes(self):
+        """Streams every recipe in the database, oldest first."""
 
-        for row in rows:
-            try:
-                post_id = row[0]
-                author = row[1]
-                karma = row[2]
-                url = row[3]
-                title = row[4]
-                ingredients = self.get_list_from_csv(row[5])
-                instructions = self.get_list_from_csv(row[6])
-                recipe_type = row[7]
-                time_posted = row[8]
-
-                post_info = PostInfo(author, karma, time_posted, post_id, url)
-                refined_post = RefinedPost(title, ingredients, instructions,
-                                           recipe_type)
-                recipe = Recipe(post_info, refined_post)
-                recipe_list.append(recipe)
-
-            except TypeError:
-                print(author, 'was not a valid author in the Recipes '
-                              'database.')
-
-        return recipe_list
+        return self.iter_recipes(order_by='time')
 
     def get_csv(self, list_of_strings):
-        """Converts a list of strings to a semi-colon separated string.
+        """
+        Converts a list of strings to a semi-colon separated string.
+        Semi-colons inside the strings are escaped with a backslash.
 
         :param list_of_strings: The list of strings to convert.
         :return: The string that was converted from the list.
         """
 
-        return ';'.join(list_of_strings)
+        return join_values(list_of_strings)
 
     def deserialize_to_recipe(self, recipe_id):
         """
@@ -143,29 +936,13 @@ class Database:
         :return: The recipe object.
         """
 
-        sql = 'SELECT * FROM Recipes WHERE post_id = ?'
-        row = self.cursor.execute(sql, [recipe_id]).fetchone()
+        recipe = next(self.iter_recipes('post_id = ?', [recipe_id]), None)
 
-        try:
-            post_id = row[0]
-            author = row[1]
-            karma = row[2]
-            url = row[3]
-            title = row[4]
-            ingredients = self.get_list_from_csv(row[5])
-            instructions = self.get_list_from_csv(row[6])
-            recipe_type = row[7]
-            time_posted = row[8]
-
-            post_info = PostInfo(author, karma, time_posted, post_id, url)
-            refined_post = RefinedPost(title, ingredients, instructions,
-                                       recipe_type)
-            recipe = Recipe(post_info, refined_post)
-            return recipe
-
-        except TypeError:
+        if recipe is None:
             print(recipe_id, 'was not a valid entry in the Recipes database.')
 
+        return recipe
+
     def get_list_from_csv(self, csv_of_strings):
         """
         Converts a string of semi-colon separated values into a list of
@@ -174,4 +951,4 @@ class Database:
         :param csv_of_strings: The string to convert back into a list.
         :return: The list of values from the string.
         """
-        return csv_of_strings.split(';')
+        return split_values(csv_of_strings)
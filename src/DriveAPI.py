@@ -50,6 +50,29 @@ class DriveClient:
 
         media_body = googleapiclient.http.MediaFileUpload(
             file_src, mimetype=self.mimetype, resumable=True)
+        self.upload(media_body, title, description)
+
+    def push_stream(self, stream, title, description=''):
+        """Creates a Google Doc from an in-memory document.
+
+        :param stream: The binary stream holding the document, positioned at
+        its start.
+        :param title: The title of the Google Doc.
+        :param description: A description of the Google Doc.
+        """
+
+        media_body = googleapiclient.http.MediaIoBaseUpload(
+            stream, mimetype=self.mimetype, resumable=True)
+        self.upload(media_body, title, description)
+
+    def upload(self, media_body, title, description):
+        """Uploads a document and converts it to a Google Doc.
+
+        :param media_body: The media upload holding the document.
+        :param title: The title of the Google Doc.
+        :param description: A description of the Google Doc.
+        """
+
         body = {
             'title': title,
             'description': description
@@ -0,0 +1,241 @@
+"""A local stand-in for Reddit, for running the bot offline.
+
+Serves a fixed synthetic corpus of threads, built with the Synthetic module,
+with a configurable delay and failure rate on every request, so the whole
+bot can be timed or load-tested without touching the real site.
+"""
+
+import random
+import threading
+from time import sleep, time
+from src import Synthetic
+from src.RedditSource import RedditSource, SourceError
+
+THREADS = 100
+COMMENTS_PER_THREAD = 20
+MAX_DEPTH = 4
+RECIPE_SHARE = 0.3
+# Reddit lists 25 submissions per page, and expanding a thread takes one
+# more request for every batch of hidden comments.
+PAGE_SIZE = 25
+MORE_COMMENTS_SIZE = 100
+PERMALINK = 'https://www.reddit.com/r/EatCheapAndHealthy/comments/{0}/_/'
+
+
+class FakeAuthor:
+    """The author of a fake post."""
+
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeSubmission:
+    """A submission with the attributes the bot reads from PRAW's."""
+
+    __slots__ = ('id', 'title', 'selftext', 'author', 'score', 'created',
+                 'permalink', 'comments')
+
+    def __init__(self, post_id, title, selftext, author, score, created):
+        self.id = post_id
+        self.title = title
+        self.selftext = selftext
+        self.author = FakeAuthor(author)
+        self.score = score
+        self.created = created
+        self.permalink = PERMALINK.format(post_id)
+        self.comments = []
+
+
+class FakeComment:
+    """A comment with the attributes the bot reads from PRAW's."""
+
+    __slots__ = ('id', 'body', 'author', 'score', 'created', 'link_id',
+                 'parent_id', 'replies')
+
+    def __init__(self, post_id, body, author, score, created, link_id,
+                 parent_id):
+        self.id = post_id
+        self.body = body
+        self.author = FakeAuthor(author)
+        self.score = score
+        self.created = created
+        self.link_id = link_id
+        self.parent_id = parent_id
+        self.replies = []
+
+
+class FakeMore:
+    """A stub standing in for the next batch of top level comments."""
+
+    __slots__ = ('parent_id', 'comments')
+
+    def __init__(self, parent_id, comments):
+        self.parent_id = parent_id
+        self.comments = comments
+
+
+class FakeSource(RedditSource):
+    """
+    Source of synthetic threads. Every request sleeps for the latency, and
+    then fails with a SourceError at the error rate.
+
+    All posts are older than a day, so the bot checks every thread.
+    """
+
+    def __init__(self, threads=THREADS, comments=COMMENTS_PER_THREAD,
+                 max_depth=MAX_DEPTH, latency=0.0, error_rate=0.0,
+                 recipe_share=RECIPE_SHARE, seed=0, titles=None):
+        """
+        :param threads: How many threads to serve.
+        :param comments: How many comments each thread has.
+        :param max_depth: How deep comments nest, 1 for top level only.
+        :param latency: How many seconds every request takes.
+        :param error_rate: The share of requests that fail, from 0 to 1.
+        :param recipe_share: The share of posts that contain a recipe.
+        :param seed: The seed, so that every run serves the same corpus and
+        fails the same requests.
+        :param titles: The recipe titles to use, loaded from disk if missing.
+        """
+
+        self.latency = latency
+        self.error_rate = error_rate
+        self.failures = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+        rng = random.Random(seed)
+        titles = titles if titles is not None else Synthetic.load_titles()
+        now = int(time())
+        self.submissions = [self.build_thread(rng, titles, thread_num, now,
+                                              comments, max_depth,
+                                              recipe_share)
+                            for thread_num in range(threads)]
+        self.by_id = dict((submission.id, submission)
+                          for submission in self.submissions)
+        self.newest = sorted(self.submissions, reverse=True,
+                             key=lambda submission: submission.created)
+
+    def build_thread(self, rng, titles, thread_num, now, comments, max_depth,
+                     recipe_share):
+        """Builds a submission and its tree of comments.
+
+        :return: The submission, with its top level comments in comments.
+        """
+
+        created = now - 2 * 86400 - rng.randrange(5 * 86400)
+        if rng.random() < recipe_share:
+            title, selftext = Synthetic.recipe_post(rng, titles,
+                                                    rng.randint(3, 15))
+        else:
+            title = Synthetic.chatter(rng)
+            selftext = Synthetic.chatter_post(rng, rng.randint(1, 6))
+        submission = FakeSubmission('f{0}'.format(thread_num), title,
+                                    selftext, 'user{0}'.format(
+                                        rng.randrange(5000)),
+                                    rng.randint(0, 2000), created)
+
+        link_id = 't3_' + submission.id
+        open_parents = []
+        for comment_num in range(comments):
+            if rng.random() < recipe_share:
+                body = Synthetic.recipe_post(rng, titles,
+                                             rng.randint(3, 15))[1]
+            else:
+                body = Synthetic.chatter_post(rng, rng.randint(1, 6))
+            parent, depth = None, 1
+            if open_parents and rng.random() < 0.6:
+                parent, depth = rng.choice(open_parents)
+                depth += 1
+            comment = FakeComment(
+                '{0}c{1}'.format(submission.id, comment_num), body,
+                'user{0}'.format(rng.randrange(5000)), rng.randint(-5, 500),
+                created + rng.randrange(86400), link_id,
+                't1_' + parent.id if parent is not None else link_id)
+            if parent is None:
+                submission.comments.append(comment)
+            else:
+                parent.replies.append(comment)
+            if depth < max_depth:
+                open_parents.append((comment, depth))
+        return submission
+
+    def request(self):
+        """Waits like a request to Reddit would, and fails at random."""
+
+        with self.lock:
+            self.requests += 1
+            failed = self.failures.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        if self.latency:
+            sleep(self.latency)
+        if failed:
+            raise SourceError('Fake server error')
+
+    def get_submissions(self):
+        """Lists the submissions, one page of them per request."""
+
+        return self.get_pages(self.submissions)
+
+    def get_new(self):
+        """Lists the submissions newest first, one page per request."""
+
+        return self.get_pages(self.newest)
+
+    def get_pages(self, submissions):
+        """Hands out submissions, making a request for every page."""
+
+        for start in range(0, len(submissions), PAGE_SIZE):
+            self.request()
+            for submission in submissions[start:start + PAGE_SIZE]:
+                yield submission
+
+    def get_submission(self, submission_id):
+        """Fetches a submission by its id."""
+
+        self.request()
+        if submission_id not in self.by_id:
+            raise SourceError('No submission ' + submission_id)
+        return self.by_id[submission_id]
+
+    def get_comment_forest(self, submission):
+        """
+        Loads the first batch of top level comments, with all their replies,
+        and a stub for the rest.
+        """
+
+        self.request()
+        return self.get_batch('t3_' + submission.id, submission.comments)
+
+    def is_more(self, post):
+        """Tells the stubs of unloaded comment batches apart."""
+
+        return isinstance(post, FakeMore)
+
+    def expand_more(self, more):
+        """Loads the next batch of top level comments."""
+
+        self.request()
+        return self.get_batch(more.parent_id, more.comments)
+
+    def get_batch(self, parent_id, comments):
+        """
+        Hands out a batch of comments, followed by a stub for the rest if
+        there are more.
+        """
+
+        batch = comments[:MORE_COMMENTS_SIZE]
+        if len(comments) > MORE_COMMENTS_SIZE:
+            batch.append(FakeMore(parent_id, comments[MORE_COMMENTS_SIZE:]))
+        return batch
+
+    def is_submission(self, post):
+        """Tells the generated submissions apart from their comments."""
+
+        return isinstance(post, FakeSubmission)
+
+    def __str__(self):
+        return '{0} requests, {1} failed'.format(self.requests, self.errors)
@@ -0,0 +1,294 @@
+"""Fetches from a RedditSource concurrently, within a rate limit.
+
+Several comment trees are expanded at once in a thread pool, while a token
+bucket keeps the requests of all threads within the rate Reddit allows.
+Failed requests are retried with exponential backoff and jitter, so a
+single failure no longer ends the whole run.
+
+Comments are handed over while their thread is still being walked, through
+a buffer of bounded size, so that even the largest threads never sit in
+memory all at once.
+"""
+
+import queue
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, sleep
+from src.Metrics import metrics
+from src.RedditSource import SourceError
+
+FETCH_WORKERS = 4
+# Reddit allows 60 requests a minute.
+REQUESTS_PER_SECOND = 1.0
+BURST = 5
+RETRIES = 4
+BASE_DELAY = 2.0
+MAX_DELAY = 60.0
+# How many comments of a thread may wait to be checked.
+BUFFER_SIZE = 500
+# How often a walk waiting for room in its buffer checks if it was closed.
+STOP_POLL_SECONDS = 0.1
+# Put in a buffer after the last comment of a thread.
+END = object()
+
+
+class TokenBucket:
+    """Rate limiter that allows short bursts.
+
+    Safe to use from several threads at once. Waiting callers are served in
+    the order they asked.
+    """
+
+    def __init__(self, rate=REQUESTS_PER_SECOND, burst=BURST):
+        """
+        :param rate: How many tokens are added per second.
+        :param burst: How many tokens can be saved up.
+        """
+
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Takes a token, sleeping until one is available."""
+
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Reserves the token, so later callers wait behind this one.
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            sleep(wait)
+
+
+class CommentStream:
+    """
+    The comments of a thread, walked in a worker thread and handed over
+    through a bounded buffer. The walk stops fetching while the buffer is
+    full, and stops for good once the stream is closed.
+    """
+
+    def __init__(self, buffer_size=BUFFER_SIZE):
+        """
+        :param buffer_size: How many comments may wait in the buffer.
+        """
+
+        self.buffer = queue.Queue(buffer_size)
+        self.closed = threading.Event()
+
+    def fill(self, comments):
+        """Walks the comments into the buffer, in the worker thread.
+
+        :param comments: An iterable of comments, e.g. a walk of a thread.
+        """
+
+        try:
+            for comment in comments:
+                if not self.put(comment):
+                    return
+            item = END
+        except Exception as error:
+            # Raised again in the thread that reads the stream.
+            item = error
+        self.put(item)
+
+    def put(self, item):
+        """Waits for room in the buffer, unless the stream gets closed.
+
+        :return: Whether the item was put in the buffer.
+        """
+
+        while not self.closed.is_set():
+            try:
+                self.buffer.put(item, timeout=STOP_POLL_SECONDS)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __iter__(self):
+        while True:
+            item = self.buffer.get()
+            if item is END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def close(self):
+        """Stops the walk, e.g. when the rest of it is not needed."""
+
+        self.closed.set()
+
+
+class Fetcher:
+    """
+    Rate limited, retrying access to a RedditSource, which can expand the
+    comments of upcoming threads while the current one is checked.
+    """
+
+    def __init__(self, source, workers=FETCH_WORKERS,
+                 rate=REQUESTS_PER_SECOND, burst=BURST, retries=RETRIES,
+                 base_delay=BASE_DELAY, max_delay=MAX_DELAY,
+                 buffer_size=BUFFER_SIZE, max_depth=None, min_score=None):
+        """
+        :param source: The RedditSource to fetch from.
+        :param workers: How many comment trees are expanded at once.
+        :param rate: How many requests may be made per second.
+        :param burst: How many requests may be made at once after a pause.
+        :param retries: How often a failed request is tried again.
+        :param base_delay: The longest wait in seconds before the first
+        retry. Every further retry may wait twice as long.
+        :param max_delay: The longest wait in seconds before any retry.
+        :param buffer_size: How many comments of a thread may wait to be
+        checked. At most one more thread than there are workers is walked
+        at once.
+        :param max_depth: How deep into threads to walk, 1 for top level
+        comments only, or None for all comments.
+        :param min_score: The lowest score of a comment to walk, or None
+        for all comments.
+        """
+
+        self.source = source
+        self.workers = workers
+        self.bucket = TokenBucket(rate, burst)
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.buffer_size = buffer_size
+        self.max_depth = max_depth
+        self.min_score = min_score
+        self.rng = random.Random()
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.prefetched = {}
+
+    def call(self, stage, function, *args):
+        """
+        Makes a request within the rate limit, retrying it when it fails.
+        Every attempt is timed as the given stage.
+
+        :param stage: The name the attempts are timed under.
+        :param function: The source method to call.
+        :param args: The arguments to call it with.
+        :return: What the function returned.
+        :raise SourceError: If the last retry failed as well.
+        """
+
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            try:
+                with metrics.time(stage):
+                    return function(*args)
+            except SourceError as error:
+                if attempt == self.retries:
+                    raise
+                # Full jitter, so retries of parallel requests spread out.
+                delay = self.rng.uniform(
+                    0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                metrics.count('retries')
+                print('Request failed ({0}), retrying in {1:.1f}s'.format(
+                    error, delay))
+                sleep(delay)
+
+    def get_submission(self, submission_id):
+        """Fetches a submission, retrying on failure."""
+
+        return self.call('fetch', self.source.get_submission, submission_id)
+
+    def request(self, function, *args):
+        """Makes a request of a comment walk, retrying on failure."""
+
+        return self.call('comment_expansion', function, *args)
+
+    def stream_comments(self, submission):
+        """Starts walking the comments of a thread in the thread pool.
+
+        :param submission: The submission of the thread.
+        :return: The CommentStream of the walk.
+        """
+
+        stream = CommentStream(self.buffer_size)
+        self.pool.submit(stream.fill, self.source.iter_comments(
+            submission, self.max_depth, self.min_score, self.request))
+        return stream
+
+    def iter_comments(self, submission):
+        """
+        Hands out the comments of a thread as they are fetched, from the
+        walk started ahead of time if there is one.
+
+        :param submission: The submission of the thread.
+        :return: A generator of comments, depth first.
+        :raise SourceError: If every retry of a request failed.
+        """
+
+        stream = self.prefetched.pop(submission.id, None)
+        if stream is None:
+            stream = self.stream_comments(submission)
+        try:
+            for comment in stream:
+                yield comment
+        finally:
+            stream.close()
+
+    def prefetch_comments(self, submissions, skip=None):
+        """
+        Starts walking the comments of upcoming threads in the thread pool,
+        keeping as many walks ahead as there are workers.
+
+        :param submissions: The submissions whose threads will be checked.
+        :param skip: The ids of submissions whose comments are not needed.
+        :return: A generator of the same submissions, in the same order,
+        each handed out with its walk ready for iter_comments.
+        """
+
+        in_flight = deque()
+        try:
+            for submission in submissions:
+                if skip is not None and submission.id in skip:
+                    stream = None
+                else:
+                    stream = self.stream_comments(submission)
+                in_flight.append((submission, stream))
+                if len(in_flight) > self.workers:
+                    yield self.hand_out(*in_flight.popleft())
+            while in_flight:
+                yield self.hand_out(*in_flight.popleft())
+        finally:
+            # Walks not handed out yet are not needed anymore.
+            for _, stream in in_flight:
+                if stream is not None:
+                    stream.close()
+            self.drop_prefetched()
+
+    def hand_out(self, submission, stream):
+        """
+        Files a walk for iter_comments, closing the one of the previous
+        thread if it was not read to the end, so it frees its worker.
+
+        :return: The submission.
+        """
+
+        self.drop_prefetched()
+        if stream is not None:
+            self.prefetched[submission.id] = stream
+        return submission
+
+    def drop_prefetched(self):
+        """Closes the walks that were handed out but not read."""
+
+        for stream in self.prefetched.values():
+            stream.close()
+        self.prefetched.clear()
+
+    def close(self):
+        """Stops the thread pool once the running requests are done."""
+
+        self.pool.shutdown()
@@ -0,0 +1,77 @@
+"""Reduces ingredient lines to canonical ingredient names for indexing.
+
+'- 2 cups black beans, drained' and '1 can of black beans (15 oz)' both
+become 'black bean', so recipes can be looked up by what they use no matter
+how the amounts were written.
+"""
+
+import re
+
+UNITS = {'c', 'can', 'cans', 'clove', 'cloves', 'cup', 'cups', 'dash',
+         'dashes', 'g', 'gram', 'grams', 'handful', 'handfuls', 'jar', 'jars',
+         'kg', 'l', 'lb', 'lbs', 'liter', 'liters', 'ml', 'ounce', 'ounces',
+         'oz', 'package', 'packages', 'pinch', 'pinches', 'pint', 'pints',
+         'pkg', 'pound', 'pounds', 'quart', 'quarts', 'slice', 'slices',
+         'stick', 'sticks', 't', 'tbs', 'tbsp', 'tablespoon', 'tablespoons',
+         'tsp', 'teaspoon', 'teaspoons', 'x'}
+DESCRIPTORS = {'a', 'about', 'an', 'and', 'chopped', 'cooked', 'cubed',
+               'diced', 'drained', 'fresh', 'grated', 'large', 'medium',
+               'minced', 'of', 'optional', 'peeled', 'rinsed', 'shredded',
+               'sliced', 'small', 'some', 'the', 'uncooked'}
+# Plural looking words that are already singular.
+SINGULAR = {'asparagus', 'couscous', 'hummus', 'molasses', 'swiss', 'oats',
+            'grits', 'greens', 'lemongrass'}
+
+_notes = re.compile(r'\([^)]*\)|\[[^\]]*\]')
+# Anything after these is preparation notes or alternatives.
+_cut = re.compile(r',|;|\bor\b|\bfor\b|\bto taste\b')
+_word = re.compile(r"[a-z]+(?:'[a-z]+)?")
+
+
+def canonicalize(line):
+    """Reduces an ingredient line to the name of the ingredient.
+
+    :param line: The ingredient line, e.g. '- 2 cups black beans, drained'.
+    :return: The canonical name, e.g. 'black bean', or None if nothing is
+    left of the line.
+    """
+
+    text = _cut.split(_notes.sub(' ', line.lower()), 1)[0]
+    words = [word for word in _word.findall(text)
+             if word not in UNITS and word not in DESCRIPTORS]
+    if not words:
+        return None
+    words[-1] = singularize(words[-1])
+    return ' '.join(words)
+
+
+def singularize(word):
+    """Turns the plural of an ingredient into its singular, roughly.
+
+    :param word: The lower case word.
+    :return: The singular of the word.
+    """
+
+    if word in SINGULAR or len(word) <= 3:
+        return word
+    if word.endswith('ies'):
+        return word[:-3] + 'y'
+    if word.endswith('oes') or word.endswith('ches') or \
+            word.endswith('shes'):
+        return word[:-2]
+    if word.endswith('s') and not word.endswith('ss') and \
+            not word.endswith('us'):
+        return word[:-1]
+    return word
+
+
+def get_ingredients(lines):
+    """Canonicalizes the ingredient lines of a recipe.
+
+    :param lines: The ingredient lines.
+    :return: A list of (position, line, ingredient) tuples, where the
+    ingredient is None for lines that name none.
+    """
+
+    return [(position, line, canonicalize(line))
+            for position, line in enumerate(lines)]
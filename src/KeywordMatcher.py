@@ -0,0 +1,136 @@
+"""Finds many keywords and phrases in a body of text in a single scan."""
+
+from collections import deque
+
+
+class KeywordMatcher:
+    """Aho-Corasick automaton over a vocabulary of labelled keywords.
+
+    Scanning a text takes time linear in its length no matter how many
+    keywords there are. Keywords only match whole words, and may span several
+    words separated by single spaces, e.g. 'family dinner'.
+    """
+
+    def __init__(self, keywords):
+        """
+        :param keywords: A mapping of label to the list of keywords for it,
+        e.g. {'Breakfast': ['breakfast', 'wake up']}.
+        """
+
+        self.labels = list(keywords)
+        self.goto = [{}]
+        self.fail = [0]
+        self.outputs = [()]
+
+        for label, terms in keywords.items():
+            for term in terms:
+                self.add_keyword(' '.join(term.lower().split()), label)
+        self.build_fail_links()
+
+    def add_keyword(self, keyword, label):
+        """Adds a keyword to the trie of the automaton.
+
+        :param keyword: The normalized keyword.
+        :param label: The label reported when the keyword is found.
+        """
+
+        if not keyword:
+            return
+
+        node = 0
+        for char in keyword:
+            child = self.goto[node].get(char)
+            if child is None:
+                child = len(self.goto)
+                self.goto[node][char] = child
+                self.goto.append({})
+                self.fail.append(0)
+                self.outputs.append(())
+            node = child
+        self.outputs[node] += ((len(keyword), label),)
+
+    def build_fail_links(self):
+        """Links every node to the longest suffix of it that is in the trie."""
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                state = self.fail[node]
+                while state and char not in self.goto[state]:
+                    state = self.fail[state]
+                fallback = self.goto[state].get(char, 0)
+                self.fail[child] = fallback if fallback != child else 0
+                self.outputs[child] += self.outputs[self.fail[child]]
+
+    def iter_matches(self, text):
+        """Finds every whole word occurrence of every keyword.
+
+        :param text: The lower case text to scan.
+        :return: A generator of (start, end, label) tuples, ordered by end.
+        """
+
+        goto = self.goto
+        fail = self.fail
+        outputs = self.outputs
+        node = 0
+
+        for end, char in enumerate(text, 1):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for length, label in outputs[node]:
+                start = end - length
+                if (start == 0 or not text[start - 1].isalnum()) and \
+                        (end == len(text) or not text[end].isalnum()):
+                    yield start, end, label
+
+    def find_all(self, text):
+        """
+        Finds the keywords in a text, preferring the longest keyword when
+        several overlap, so 'family dinner' is not also counted as 'dinner'.
+
+        :param text: The lower case text to scan.
+        :return: A list of (start, end, label) tuples, ordered by start.
+        """
+
+        matches = sorted(self.iter_matches(text),
+                         key=lambda match: (match[0], -match[1]))
+        found = []
+        last_end = 0
+        for start, end, label in matches:
+            if start >= last_end:
+                found.append((start, end, label))
+                last_end = end
+        return found
+
+    def count(self, text):
+        """Counts how often the keywords of each label appear in a text.
+
+        :param text: The lower case text to scan.
+        :return: A dict of label to count, holding every label.
+        """
+
+        counts = dict((label, 0) for label in self.labels)
+        for _, _, label in self.find_all(text):
+            counts[label] += 1
+        return counts
+
+    def match_header(self, text):
+        """
+        Checks whether a text is nothing but one of the keywords, as a
+        section header is, e.g. 'shopping list' but not 'my shopping list'.
+
+        :param text: The lower case text to check, with single spaces
+        between its words.
+        :return: The label of the keyword, or None.
+        """
+
+        found = self.find_all(text)
+        if len(found) != 1:
+            return None
+        start, end, label = found[0]
+        if start != 0 or end != len(text):
+            return None
+        return label
@@ -1,6 +1,18 @@
 """Start Script"""
 
+import argparse
+from src.Scheduler import Scheduler
 from src.Scraper import RedditAPI
 
 if __name__ == '__main__':
-    RedditAPI()
+    parser = argparse.ArgumentParser(description='Run the recipe bot.')
+    parser.add_argument('--metrics', metavar='PATH',
+                        help='write stage timings and counts here after '
+                             'every run, as JSON if PATH ends in .json and '
+                             'as Prometheus text otherwise')
+    parser.add_argument('--profile', metavar='PATH',
+                        help='save cProfile stats of every run here')
+    args = parser.parse_args()
+
+    Scheduler(RedditAPI(metrics_path=args.metrics,
+                        profile_path=args.profile)).run_forever()
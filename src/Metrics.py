@@ -0,0 +1,224 @@
+"""Timings and counts of the stages of the bot, for finding slow runs.
+
+Stages are timed into latency histograms, and every stage that raises is
+counted as an error. The metrics can be written as Prometheus text, to be
+picked up by a node exporter's textfile collector, or as JSON.
+"""
+
+import cProfile
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from time import perf_counter, time
+
+# Upper bounds of the latency buckets, in seconds.
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+PREFIX = 'ecah'
+
+
+class Histogram:
+    """Counts of observed values per bucket, plus their count and sum."""
+
+    __slots__ = ('buckets', 'counts', 'count', 'total')
+
+    def __init__(self, buckets=BUCKETS):
+        """
+        :param buckets: The ascending upper bounds of the buckets.
+        """
+
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        """Records a value in the first bucket it fits in."""
+
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.total += value
+
+    def get_cumulative_counts(self):
+        """
+        Counts the values at or below each bound, as Prometheus expects.
+
+        :return: A list of (bound, count) tuples, ending with infinity.
+        """
+
+        cumulative = []
+        running = 0
+        for bound, count in zip(self.buckets, self.counts):
+            running += count
+            cumulative.append((bound, running))
+        cumulative.append((float('inf'), self.count))
+        return cumulative
+
+
+class Metrics:
+    """Registry of stage timings and event counters.
+
+    Safe to use from several threads at once.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        """
+        :param buckets: The latency bucket bounds of every stage.
+        """
+
+        self.buckets = buckets
+        self.stages = OrderedDict()
+        self.errors = OrderedDict()
+        self.counters = OrderedDict()
+        self.started = time()
+        self.lock = threading.Lock()
+
+    def count(self, name, amount=1):
+        """Adds to an event counter.
+
+        :param name: The name of the counter, e.g. 'recipes_found'.
+        :param amount: How much to add.
+        """
+
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, stage, seconds):
+        """Records how long a stage took once.
+
+        :param stage: The name of the stage, e.g. 'fetch'.
+        :param seconds: How long it took.
+        """
+
+        with self.lock:
+            if stage not in self.stages:
+                self.stages[stage] = Histogram(self.buckets)
+                self.errors[stage] = 0
+            self.stages[stage].observe(seconds)
+
+    @contextmanager
+    def time(self, stage):
+        """
+        Times the block of a with statement as a stage. Exceptions leaving
+        the block are counted as errors of the stage, and raised again.
+
+        :param stage: The name of the stage.
+        """
+
+        start = perf_counter()
+        try:
+            yield
+        except Exception:
+            with self.lock:
+                self.errors[stage] = self.errors.get(stage, 0) + 1
+            raise
+        finally:
+            self.observe(stage, perf_counter() - start)
+
+    def to_dict(self):
+        """
+        Collects the metrics into plain values, with the throughput of
+        every stage in calls per second spent in it.
+
+        :return: A dict ready to be written as JSON.
+        """
+
+        with self.lock:
+            stages = OrderedDict()
+            for stage, histogram in self.stages.items():
+                stages[stage] = OrderedDict((
+                    ('count', histogram.count),
+                    ('seconds', histogram.total),
+                    ('per_second', histogram.count / histogram.total
+                     if histogram.total else 0.0),
+                    ('errors', self.errors.get(stage, 0)),
+                    ('buckets', OrderedDict(
+                        ('+Inf' if bound == float('inf') else str(bound),
+                         count)
+                        for bound, count in
+                        histogram.get_cumulative_counts()))))
+            return OrderedDict((('started', self.started),
+                                ('uptime', time() - self.started),
+                                ('stages', stages),
+                                ('counters', OrderedDict(self.counters))))
+
+    def to_prometheus(self):
+        """Formats the metrics in the Prometheus text exposition format."""
+
+        with self.lock:
+            lines = ['# HELP {0}_stage_seconds How long each stage of the bot '
+                     'took.'.format(PREFIX),
+                     '# TYPE {0}_stage_seconds histogram'.format(PREFIX)]
+            for stage, histogram in self.stages.items():
+                for bound, count in histogram.get_cumulative_counts():
+                    lines.append('{0}_stage_seconds_bucket{{stage="{1}",'
+                                 'le="{2}"}} {3}'.format(
+                                     PREFIX, stage, '+Inf' if bound == float(
+                                         'inf') else bound, count))
+                lines.append('{0}_stage_seconds_sum{{stage="{1}"}} '
+                             '{2}'.format(PREFIX, stage, histogram.total))
+                lines.append('{0}_stage_seconds_count{{stage="{1}"}} '
+                             '{2}'.format(PREFIX, stage, histogram.count))
+
+            lines.append('# HELP {0}_stage_errors_total How often each stage '
+                         'failed.'.format(PREFIX))
+            lines.append('# TYPE {0}_stage_errors_total counter'.format(
+                PREFIX))
+            for stage, errors in self.errors.items():
+                lines.append('{0}_stage_errors_total{{stage="{1}"}} '
+                             '{2}'.format(PREFIX, stage, errors))
+
+            for name, value in self.counters.items():
+                lines.append('# TYPE {0}_{1}_total counter'.format(
+                    PREFIX, name))
+                lines.append('{0}_{1}_total {2}'.format(PREFIX, name, value))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """
+        Writes the metrics to a file, as JSON if its name ends in .json and
+        as Prometheus text otherwise. The file is replaced in one go, so
+        readers never see half of it.
+
+        :param path: The file to write.
+        """
+
+        if path.endswith('.json'):
+            text = json.dumps(self.to_dict(), indent=2)
+        else:
+            text = self.to_prometheus()
+
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as metrics_file:
+            metrics_file.write(text)
+        os.replace(temp_path, path)
+
+
+@contextmanager
+def profile(path):
+    """
+    Profiles the block of a with statement with cProfile, if a path is
+    given, and saves the stats there for pstats or snakeviz.
+
+    :param path: The file to save the stats to, or None to not profile.
+    """
+
+    if path is None:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+
+
+# Shared by the whole bot, like the title index in the Analyzer.
+metrics = Metrics()
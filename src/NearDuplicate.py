@@ -0,0 +1,104 @@
+"""MinHash signatures for spotting recipes that were reposted or copied.
+
+Two recipes with mostly the same ingredients and instructions get mostly the
+same signature values. Signatures are cut into bands, and recipes sharing
+any band end up in the same bucket of the locality sensitive hashing (LSH)
+index, so finding candidates only takes one index lookup per band instead
+of a comparison against every stored recipe.
+"""
+
+import hashlib
+import random
+import re
+import struct
+import zlib
+
+NUM_PERMUTATIONS = 64
+BANDS = 16
+ROWS_PER_BAND = NUM_PERMUTATIONS // BANDS
+SHINGLE_SIZE = 3
+MIN_SHINGLES = 5
+SIMILARITY_THRESHOLD = 0.8
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+_word = re.compile(r'[a-z0-9]+')
+
+
+def get_shingles(ingredients, instructions):
+    """Breaks the text of a recipe into overlapping runs of words.
+
+    :param ingredients: The ingredient lines of the recipe.
+    :param instructions: The instruction lines of the recipe.
+    :return: A set of 32 bit shingle hashes.
+    """
+
+    words = _word.findall('\n'.join(list(ingredients) +
+                                    list(instructions)).lower())
+    return set(zlib.crc32(' '.join(words[start:start + SHINGLE_SIZE]).encode())
+               for start in range(max(len(words) - SHINGLE_SIZE + 1, 0)))
+
+
+class MinHasher:
+    """Computes MinHash signatures and their LSH band buckets."""
+
+    def __init__(self, seed=1):
+        """
+        :param seed: Seed of the hash permutations. Signatures are only
+        comparable when made with the same seed.
+        """
+
+        rng = random.Random(seed)
+        self.permutations = [(rng.randrange(1, MERSENNE_PRIME),
+                              rng.randrange(0, MERSENNE_PRIME))
+                             for _ in range(NUM_PERMUTATIONS)]
+
+    def get_signature(self, shingles):
+        """Computes the MinHash signature of a set of shingles.
+
+        :param shingles: The set of shingle hashes.
+        :return: A tuple of NUM_PERMUTATIONS integers.
+        """
+
+        return tuple(min(((a * shingle + b) % MERSENNE_PRIME) & MAX_HASH
+                         for shingle in shingles)
+                     for a, b in self.permutations)
+
+    def get_buckets(self, signature):
+        """Hashes each band of a signature into a bucket number.
+
+        :param signature: The MinHash signature.
+        :return: A list of (band, bucket) tuples, one per band.
+        """
+
+        buckets = []
+        for band in range(BANDS):
+            values = signature[band * ROWS_PER_BAND:
+                               (band + 1) * ROWS_PER_BAND]
+            digest = hashlib.md5(pack_signature(values)).digest()
+            buckets.append((band, struct.unpack('>q', digest[:8])[0]))
+        return buckets
+
+
+def get_similarity(signature, other_signature):
+    """Estimates the Jaccard similarity of two recipes from their signatures.
+
+    :return: The share of signature values that are equal, from 0 to 1.
+    """
+
+    same = sum(1 for value, other in zip(signature, other_signature)
+               if value == other)
+    return same / len(signature)
+
+
+def pack_signature(signature):
+    """Packs a signature into bytes for storage."""
+
+    return struct.pack('>{0}I'.format(len(signature)), *signature)
+
+
+def unpack_signature(data):
+    """Unpacks a signature stored by pack_signature."""
+
+    return struct.unpack('>{0}I'.format(len(data) // 4), data)
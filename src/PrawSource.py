@@ -0,0 +1,104 @@
+"""Reddit itself as the source of threads, through PRAW."""
+
+import praw
+from src.RedditSource import RedditSource, SourceError
+
+USER_AGENT = 'ECAH Scraper by /u/ECAH_Scraper'
+SUBREDDIT = 'EatCheapAndHealthy'
+
+
+class PrawSource(RedditSource):
+    """Fetches threads from Reddit.
+
+    PRAW's HTTP errors are raised as SourceErrors, so the bot does not need
+    to know about PRAW.
+    """
+
+    def __init__(self, user_agent=USER_AGENT, subreddit=SUBREDDIT):
+        """
+        :param user_agent: The user agent to identify the bot with.
+        :param subreddit: The name of the subreddit to scan.
+        """
+
+        self.reddit = praw.Reddit(user_agent)
+        self.subreddit = self.reddit.get_subreddit(subreddit)
+
+    def get_submissions(self):
+        """Lists the hot submissions of the subreddit."""
+
+        try:
+            for submission in self.subreddit.get_hot(limit=None):
+                yield submission
+        except praw.errors.HTTPException as error:
+            raise SourceError(str(error)) from error
+
+    def get_new(self):
+        """Lists the newest submissions of the subreddit."""
+
+        try:
+            for submission in self.subreddit.get_new(limit=None):
+                yield submission
+        except praw.errors.HTTPException as error:
+            raise SourceError(str(error)) from error
+
+    def get_submission(self, submission_id):
+        """Fetches a submission by its id."""
+
+        try:
+            return self.reddit.get_submission(submission_id=submission_id)
+        except praw.errors.HTTPException as error:
+            raise SourceError(str(error)) from error
+
+    def get_comment_forest(self, submission):
+        """
+        Loads the comments of a submission as first shown. They are not
+        kept on the submission, which stays cached for the whole run, and
+        the links to more comments are pointed at it for expand_more.
+        """
+
+        try:
+            forest = praw.objects.Submission.from_url(
+                self.reddit, submission.permalink, comments_only=True)
+        except praw.errors.HTTPException as error:
+            raise SourceError(str(error)) from error
+        self.set_submission(forest, submission)
+        return forest
+
+    def is_more(self, post):
+        """Tells "load more comments" links apart from comments."""
+
+        return isinstance(post, praw.objects.MoreComments)
+
+    def expand_more(self, more):
+        """
+        Fetches the comments behind a "load more comments" link, without
+        adding them to the submission's comments.
+        """
+
+        try:
+            comments = more.comments(update=False) or []
+        except praw.errors.HTTPException as error:
+            raise SourceError(str(error)) from error
+        # PRAW keeps the comments on the link, which is still in the tree
+        # being walked, so the whole thread would pile up there.
+        more._comments = None
+        self.set_submission(comments, more.submission)
+        return comments
+
+    def set_submission(self, comments, submission):
+        """
+        Points the "load more comments" links among some comments at their
+        submission, which PRAW only does for comments added to it.
+
+        :param comments: A list of comments and links, with their replies.
+        :param submission: The submission of the thread.
+        """
+
+        for post in praw.helpers.flatten_tree(comments):
+            if self.is_more(post):
+                post.submission = submission
+
+    def is_submission(self, post):
+        """Tells submissions apart from comments."""
+
+        return isinstance(post, praw.objects.Submission)
@@ -1,12 +1,20 @@
-"""Container classes"""
+"""Container classes
+
+All of them use __slots__ instead of a __dict__, since large archives hold
+many thousands of recipes in memory at once.
+"""
 
 
 class Recipe:
     """Concrete Recipe.
 
     Holds a unique recipe with the ability to display it in several ways.
+    The ingredients and instructions are stored as tuples.
     """
 
+    __slots__ = ('author', 'karma', 'time', 'id', 'url', 'title',
+                 'ingredients', 'instructions', 'type')
+
     def __init__(self, post_info, refined_post):
         self.author = post_info.author
         self.karma = post_info.karma
@@ -14,10 +22,30 @@ class Recipe:
         self.id = post_info.id
         self.url = post_info.link
         self.title = refined_post.title
-        self.ingredients = refined_post.ingredients
-        self.instructions = refined_post.instructions
+        self.ingredients = tuple(refined_post.ingredients)
+        self.instructions = tuple(refined_post.instructions)
         self.type = refined_post.type
 
+    @classmethod
+    def from_values(cls, post_id, author, karma, url, title, ingredients,
+                    instructions, recipe_type, time_posted):
+        """
+        Creates a recipe straight from its values, in the column order of the
+        Recipes table, without building a PostInfo and RefinedPost first.
+        """
+
+        recipe = cls.__new__(cls)
+        recipe.author = author
+        recipe.karma = karma
+        recipe.time = time_posted
+        recipe.id = post_id
+        recipe.url = url
+        recipe.title = title
+        recipe.ingredients = tuple(ingredients)
+        recipe.instructions = tuple(instructions)
+        recipe.type = recipe_type
+        return recipe
+
     def simple_print(self):
         """
         A minimalistic display of the recipe with just the title, ingredients,
@@ -48,6 +76,8 @@ class Recipe:
 class PostInfo:
     """Container for username and karma score of a post."""
 
+    __slots__ = ('author', 'karma', 'time', 'id', 'link')
+
     def __init__(self, username, karma, date_posted, post_id, link):
         """
         :param username: The reddit username of the original poster.
@@ -67,6 +97,8 @@ class PostInfo:
 class RefinedPost:
     """Container for title, ingredients, and instructions of a recipe."""
 
+    __slots__ = ('title', 'ingredients', 'instructions', 'type')
+
     def __init__(self, title, ingredients, instructions, recipe_type):
         """
         :param title: The title of the recipe.
@@ -76,6 +108,44 @@ class RefinedPost:
         """
 
         self.title = title
+        self.ingredients = tuple(ingredients)
+        self.instructions = tuple(instructions)
+        self.type = recipe_type
+
+
+class RawPost:
+    """Container for the plain text of a fetched post, ready for analysis.
+
+    Holds no Reddit objects, so it can be handed to another process.
+    """
+
+    __slots__ = ('post_info', 'title', 'content')
+
+    def __init__(self, post_info, title, content):
+        """
+        :param post_info: The PostInfo of the post.
+        :param title: The title of the post, empty for comments.
+        :param content: The body of the post.
+        """
+
+        self.post_info = post_info
+        self.title = title
+        self.content = content
+
+
+class ParsedPost:
+    """Container for the sections found in the text of a post."""
+
+    __slots__ = ('is_recipe', 'ingredients', 'instructions')
+
+    def __init__(self, is_recipe, ingredients, instructions):
+        """
+        :param is_recipe: Whether the post has both an ingredients and an
+        instructions section.
+        :param ingredients: The list of ingredients found.
+        :param instructions: The list of instructions found.
+        """
+
+        self.is_recipe = is_recipe
         self.ingredients = ingredients
         self.instructions = instructions
-        self.type = recipe_type
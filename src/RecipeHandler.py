@@ -4,23 +4,62 @@ Scraper that searches through posts within ECAH for recipes and stores them in
 a database.
 """
 
+import io
 from src.DatabaseUtil import Database
 from src.DriveAPI import DriveClient
 from time import time, strftime, gmtime
 
 DAY_IN_SECONDS = 86400
 WEEK_IN_SECONDS = 604800 + DAY_IN_SECONDS  # 8 days ago
+FLUSH_SIZE = 25
+FLUSH_SECONDS = 60
+DIGEST_PATH = '../misc/document.txt'
+DIGEST_ORDER = 'karma DESC, time'
+DIGEST_SEPARATOR = '\n' + '-' * 124 + '\n\n'
+
+
+def write_digest(recipes, stream):
+    """Writes recipes to a text stream one at a time, in the given order.
+
+    :param recipes: An iterable of recipes, e.g. straight from the database.
+    :param stream: The text stream to write to.
+    :return: The amount of recipes written.
+    """
+
+    count = 0
+    for recipe in recipes:
+        stream.write(str(recipe))
+        stream.write(DIGEST_SEPARATOR)
+        count += 1
+    return count
 
 
 class RecipeHandler:
     """
     Medium class that takes incoming recipes and stores them into a database.
+
+    Recipes are queued and written in batches once enough of them piled up
+    or enough time has passed since the last write.
     """
 
-    def __init__(self):
+    def __init__(self, db=None, drive=None, flush_size=FLUSH_SIZE,
+                 flush_seconds=FLUSH_SECONDS):
+        """
+        :param db: The Database to store the recipes in, the default one if
+        not given.
+        :param drive: The DriveClient to post the digest with, signed in on
+        first use if not given.
+        :param flush_size: How many queued recipes trigger a write.
+        :param flush_seconds: How many seconds a recipe may stay queued
+        before a write is triggered.
+        """
+
         self.recipe_list = []
-        self.db = Database()
-        self.drive = DriveClient()
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self.last_flush = time()
+        self.db = db if db is not None else Database()
+        self.drive = drive
 
     def add(self, recipe):
         """
@@ -34,35 +73,77 @@ class RecipeHandler:
         self.manage_queue()
 
     def manage_queue(self):
+        """
+        Stores the recipes within the queue in the database if there are
+        enough of them or if they have waited long enough.
+        """
+
+        if len(self.recipe_list) >= self.flush_size or \
+                time() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self, progress=None):
         """
         Takes all the recipes within the queue and stores them in the
         database.
+
+        :param progress: A (submission_id, position, recipe_type) tuple of
+        how far into its thread the bot got and the type of its recipes so
+        far, stored in the same transaction as the recipes, so neither is
+        written without the other.
         """
 
-        while len(self.recipe_list) > 0:
-            recipe = self.recipe_list.pop()
-            self.db.add(recipe)
+        if self.recipe_list or progress is not None:
+            self.db.add_many(self.recipe_list, progress)
+            self.recipe_list = []
+        self.last_flush = time()
+
+    def get_drive(self):
+        """Gets the Google Drive client, signing in on first use."""
+
+        if self.drive is None:
+            self.drive = DriveClient()
+        return self.drive
 
-    def post_weekly(self):
+    def close(self):
+        """Stores any queued recipes and closes the database."""
+
+        self.flush()
+        self.db.close()
+
+    def post_weekly(self, top_n=None, in_memory=False):
         """
         Gets last weeks recipes, writes them to a file in descending order of
         karma points, and posts that file to a Google Drive doc.
-        """
 
-        recipes = self.db.get_last_weeks_recipes()
-        recipes.sort(key=lambda recipe_item: recipe_item.karma, reverse=True)
+        The database does the ordering, and recipes are written as they are
+        read, so the whole week is never held in memory.
 
-        path = '../misc/document.txt'
+        :param top_n: Only post this many of the top recipes, if given.
+        :param in_memory: Build the document in memory instead of writing
+        it to a file first.
+        """
 
-        with open(path, 'w') as weekly_doc:
-            endline = '\n' + '-' * 124 + '\n\n'
-            for recipe in recipes:
-                weekly_doc.write(''.join((str(recipe), endline)))
+        self.flush()
+        recipes = self.db.iter_last_weeks_recipes(DIGEST_ORDER, top_n)
 
         # 7 days since yesterday
         last_week = strftime("%D", gmtime(time() - WEEK_IN_SECONDS))
         yesterday = strftime("%D", gmtime(time() - DAY_IN_SECONDS))
-
-        self.drive.push_file(path, last_week + ' - ' + yesterday,
-                             description='Top recipes for week of ' +
-                                         last_week)
+        title = last_week + ' - ' + yesterday
+        description = 'Top recipes for week of ' + last_week
+
+        if in_memory:
+            buffer = io.BytesIO()
+            weekly_doc = io.TextIOWrapper(buffer, encoding='utf-8',
+                                          write_through=True)
+            write_digest(recipes, weekly_doc)
+            weekly_doc.detach()
+            buffer.seek(0)
+            self.get_drive().push_stream(buffer, title,
+                                         description=description)
+        else:
+            with open(DIGEST_PATH, 'w') as weekly_doc:
+                write_digest(recipes, weekly_doc)
+            self.get_drive().push_file(DIGEST_PATH, title,
+                                       description=description)
@@ -0,0 +1,156 @@
+"""Where the bot gets its submissions and comments from."""
+
+from abc import ABC, abstractmethod
+from itertools import chain
+
+
+class SourceError(Exception):
+    """Raised when the source fails to answer, e.g. when Reddit is down."""
+
+
+class RedditSource(ABC):
+    """
+    Interface of a source of threads. Posts handed out only need the
+    attributes the bot reads from PRAW objects: id, author.name, score,
+    created and permalink, plus title and selftext on submissions and body,
+    link_id, parent_id and replies on comments.
+
+    Stubs standing in for hidden comments only need a parent_id.
+    """
+
+    @abstractmethod
+    def get_submissions(self):
+        """Lists the submissions of the subreddit.
+
+        :return: An iterable of submissions.
+        :raise SourceError: If the listing can't be fetched.
+        """
+
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_new(self):
+        """Lists the submissions of the subreddit, newest first.
+
+        :return: An iterable of submissions.
+        :raise SourceError: If the listing can't be fetched.
+        """
+
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_submission(self, submission_id):
+        """Fetches a single submission.
+
+        :param submission_id: The id of the submission.
+        :return: The submission.
+        :raise SourceError: If the submission can't be fetched.
+        """
+
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_comment_forest(self, submission):
+        """
+        Fetches the comments of a thread as first loaded: the top level
+        comments with their loaded replies, and stubs for the hidden ones.
+
+        :param submission: The submission of the thread.
+        :return: A list of comments and stubs.
+        :raise SourceError: If the comments can't be fetched.
+        """
+
+        raise NotImplementedError
+
+    @abstractmethod
+    def is_more(self, post):
+        """Tells stubs of hidden comments apart from comments.
+
+        :param post: A comment or stub handed out by this source.
+        :return: True for a stub.
+        """
+
+        raise NotImplementedError
+
+    @abstractmethod
+    def expand_more(self, more):
+        """Fetches the comments a stub stands for.
+
+        :param more: The stub.
+        :return: A list of comments and stubs, with loaded replies or with
+        their parent_ids pointing at each other.
+        :raise SourceError: If the comments can't be fetched.
+        """
+
+        raise NotImplementedError
+
+    def iter_comments(self, submission, max_depth=None, min_score=None,
+                      request=None):
+        """
+        Walks the comments of a thread depth first, expanding stubs as they
+        are reached, so comments are handed out while later ones are still
+        to be fetched. Only the comments on the way to the current one are
+        held on to, rather than the whole flattened thread.
+
+        :param submission: The submission of the thread.
+        :param max_depth: How deep to go, 1 for top level comments only.
+        Deeper comments and their stubs are never fetched.
+        :param min_score: The lowest score of a comment to hand out. Replies
+        to lower scored comments are skipped along with them.
+        :param request: Function making the requests, called with the source
+        method and its arguments. The method is called directly if not
+        given.
+        :return: A generator of comments, in the same order on every walk
+        of an unchanged thread.
+        :raise SourceError: If some of the comments can't be fetched.
+        """
+
+        if request is None:
+            def request(function, *args):
+                return function(*args)
+
+        # Every frame is an iterator over sibling posts, with the depths of
+        # the comments they may reply to by id. Expanded stubs can hand out
+        # a flat list of comments, whose depths are found as they go.
+        stack = [(iter(request(self.get_comment_forest, submission)),
+                  {submission.id: 0})]
+        while stack:
+            posts, depths = stack[-1]
+            post = next(posts, None)
+            if post is None:
+                stack.pop()
+                continue
+
+            parent_id = post.parent_id.split('_', 1)[-1]
+            if parent_id not in depths:  # Its parent was skipped
+                continue
+            depth = depths[parent_id] + 1
+            if max_depth is not None and depth > max_depth:
+                continue
+
+            if self.is_more(post):
+                # Stubs usually come last, so their frame is dropped before
+                # the expansion is walked, rather than every expanded batch
+                # staying on the stack until the end of the thread.
+                sibling = next(posts, None)
+                if sibling is None:
+                    stack.pop()
+                else:
+                    stack[-1] = (chain([sibling], posts), depths)
+                stack.append((iter(request(self.expand_more, post)),
+                              {parent_id: depth - 1}))
+            elif min_score is None or post.score >= min_score:
+                depths[post.id] = depth
+                yield post
+                if post.replies:
+                    stack.append((iter(post.replies), {post.id: depth}))
+
+    @abstractmethod
+    def is_submission(self, post):
+        """Tells submissions apart from comments.
+
+        :param post: A post handed out by this source.
+        :return: True for a submission, False for a comment.
+        """
+
+        raise NotImplementedError
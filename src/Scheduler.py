@@ -0,0 +1,123 @@
+"""Decides when the bot looks for new threads and posts the digest.
+
+Both are driven by timestamps stored in the database, so a restart, an
+outage or a run that overruns picks up exactly where the last one stopped:
+no thread is skipped, and a missed Monday digest is posted late rather than
+not at all.
+"""
+
+from datetime import datetime, timedelta
+from time import time
+from src.Metrics import metrics
+from src.RedditSource import SourceError
+from src.Scraper import DAY_SECONDS
+
+POLL_SECONDS = 3600
+OUTAGE_SECONDS = 1800
+# How far back the very first poll looks, before there is a watermark.
+FIRST_POLL_SECONDS = 7 * DAY_SECONDS
+WATERMARK = 'watermark'
+LAST_DIGEST = 'last_digest'
+
+
+def get_digest_due(now):
+    """Finds when the latest digest was due: Monday midnight, local time.
+
+    :param now: The current time.
+    :return: The timestamp of the most recent Monday midnight.
+    """
+
+    today = datetime.fromtimestamp(now).replace(hour=0, minute=0, second=0,
+                                                microsecond=0)
+    return (today - timedelta(days=today.weekday())).timestamp()
+
+
+class Scheduler:
+    """
+    Polls for threads that turned a day old since the last poll, and posts
+    the weekly digest when it is due.
+
+    The watermark is the posting time up to which every thread was checked.
+    A poll reads the newest listing down to the watermark only, so its cost
+    grows with the new threads, not with the whole listing. Threads that
+    failed keep the watermark before them, so the next poll lists them
+    again; the ones that were checked meanwhile are skipped as seen.
+    """
+
+    def __init__(self, bot, poll_seconds=POLL_SECONDS):
+        """
+        :param bot: The RedditAPI to check the threads with.
+        :param poll_seconds: How many seconds to wait between polls.
+        """
+
+        self.bot = bot
+        self.db = bot.recipe_handler.db
+        self.poll_seconds = poll_seconds
+
+    def run_forever(self):
+        """Polls and posts digests until the process is stopped."""
+
+        # Signs in to Google Drive now, while someone is there to do it.
+        self.bot.recipe_handler.get_drive()
+        try:
+            while True:
+                try:
+                    self.poll()
+                    self.post_digest_if_due()
+                    self.bot.go_sleep(self.poll_seconds)
+                except SourceError:
+                    metrics.count('source_errors')
+                    self.bot.write_metrics()
+                    print("Server is down! Gonna sleep for 30 mins til "
+                          "things are fixed up!")
+                    self.bot.go_sleep(OUTAGE_SECONDS)
+        finally:
+            self.bot.close()
+
+    def poll(self, now=None):
+        """
+        Checks the threads that turned a day old since the last poll. The
+        watermark only moves once all of them were handed to the bot, and
+        no further than just before the oldest one that failed.
+
+        :param now: The current time, the clock's if not given.
+        """
+
+        now = now if now is not None else time()
+        until = now - DAY_SECONDS
+        since = self.db.get_state(WATERMARK)
+        if since is None:
+            since = until - FIRST_POLL_SECONDS
+
+        oldest_failed = self.bot.run_bot(
+            self.bot.get_new_submissions(since, until))
+        if oldest_failed is not None:
+            # Threads older than the seen store's window are not handed
+            # out anymore, so one that keeps failing holds it back only
+            # until then.
+            until = min(until, oldest_failed - 1)
+        self.db.set_state(WATERMARK, until)
+
+    def post_digest_if_due(self, now=None):
+        """
+        Posts the weekly digest if it was not posted since the last Monday.
+        The first time, it only remembers the digest as done, so the first
+        one is posted on the next Monday.
+
+        :param now: The current time, the clock's if not given.
+        :return: Whether the digest was posted.
+        """
+
+        now = now if now is not None else time()
+        due = get_digest_due(now)
+        last_digest = self.db.get_state(LAST_DIGEST)
+
+        if last_digest is None:
+            self.db.set_state(LAST_DIGEST, now)
+            return False
+        if last_digest >= due:
+            return False
+
+        self.bot.recipe_handler.post_weekly()
+        self.db.set_state(LAST_DIGEST, now)
+        return True
@@ -1,79 +1,356 @@
 """Analyzes posts to determine whether they are considered recipes."""
 
 from time import time, sleep
+from collections import Counter
 from datetime import datetime
-import praw
-from src.Recipe import Recipe, PostInfo, RefinedPost
+from itertools import chain, islice
+from src.AnalysisCache import AnalysisCache
+from src.Fetcher import Fetcher
+from src.Metrics import metrics, profile
+from src.Recipe import Recipe, PostInfo, RawPost
 from src.RecipeHandler import RecipeHandler
+from src.RedditSource import SourceError
+from src.SeenStore import SeenStore
 from src import Analyzer
 
 DAY_SECONDS = 24 * 3600
+ANALYSIS_WORKERS = 4
+# Threads are checked this many posts at a time. The posts and progress of
+# longer threads are saved after each batch.
+CHECKPOINT_SIZE = 200
+
+
+def get_batches(items, size):
+    """Splits an iterable into lists, without reading it all at once.
+
+    :param items: The iterable to split.
+    :param size: How many items go in every list but the last.
+    :return: A generator of lists.
+    """
+
+    items = iter(items)
+    batch = list(islice(items, size))
+    while batch:
+        yield batch
+        batch = list(islice(items, size))
+
+
+def count_types(texts, type_counts=None):
+    """Adds up the hints at each meal type in several texts.
+
+    :param texts: An iterable of texts.
+    :param type_counts: The Counter to add to, a new one if not given.
+    :return: The Counter.
+    """
+
+    if type_counts is None:
+        type_counts = Counter()
+    for text in texts:
+        type_counts.update(Analyzer.count_types(text))
+    return type_counts
+
+
+def get_text(raw_post):
+    """Joins the title and content of a RawPost."""
+
+    return raw_post.title + '\n' + raw_post.content
 
 
 class RedditAPI:
     """The Reddit API."""
 
-    def __init__(self):
-        self.reddit = praw.Reddit('ECAH Scraper by /u/ECAH_Scraper')
-        self.subreddit = self.reddit.get_subreddit('EatCheapAndHealthy')
-        self.old_submission_ids = []
-        self.fill_old_submissions()
-        self.recipe_handler = RecipeHandler()
-        while True:
-            try:
-                self.run_bot()
-                if datetime.now().isoweekday() == 1:  # Monday
-                    self.recipe_handler.post_weekly()
-                self.go_sleep(DAY_SECONDS)
-            except praw.errors.HTTPException:
-                print("Server is down! Gonna sleep for 30 mins til things are "
-                      "fixed up!")
-                self.go_sleep(1800)
+    def __init__(self, source=None, db=None, workers=ANALYSIS_WORKERS,
+                 metrics_path=None, profile_path=None, fetcher=None):
+        """
+        :param source: The RedditSource to read threads from, Reddit itself
+        through PRAW if not given.
+        :param db: The Database to store the recipes in, the default one if
+        not given.
+        :param workers: The amount of processes used to analyze posts. With 0
+        every post is analyzed in this process.
+        :param metrics_path: The file to write the stage timings and counts
+        to after every run, as JSON if it ends in .json and as Prometheus
+        text otherwise.
+        :param profile_path: The file to save cProfile stats of every run
+        to. Can be switched on or off between runs.
+        :param fetcher: The Fetcher to make requests to the source with, one
+        with the default rate limit if not given.
+        """
 
-    def fill_old_submissions(self):
-        """Retrieves old submissions stored.
+        if source is None:
+            # Imported here, so that other sources work without PRAW.
+            from src.PrawSource import PrawSource
+            source = PrawSource()
+        self.source = source
+        self.fetcher = fetcher if fetcher is not None else Fetcher(source)
+        self.workers = workers
+        self.metrics_path = metrics_path
+        self.profile_path = profile_path
+        self.pool = None
+        self.recipe_handler = RecipeHandler(db)
+        self.old_submissions = SeenStore(
+            self.recipe_handler.db, before_flush=self.recipe_handler.flush)
+        self.analysis_cache = AnalysisCache(
+            self.recipe_handler.db, Analyzer.get_analysis_version())
+
+    def close(self):
+        """Writes everything still pending and closes the database."""
+
+        # Recipes go first, so no thread is remembered without them.
+        self.recipe_handler.flush()
+        self.old_submissions.flush()
+        self.analysis_cache.flush()
+        self.recipe_handler.close()
+        self.fetcher.close()
+
+    def run_bot(self, submissions=None):
+        """Checks every listed thread that was not checked before.
+
+        :param submissions: The submissions to go through, the hot listing
+        if not given.
+        :return: The posting time of the oldest thread that could not be
+        checked, or None if none failed.
+        """
 
-        Used in case of Reddit's servers going down.
+        print("Working...")
+        oldest_failed = None
+        fetched = self.recipe_handler.db.get_fetched_threads()
+        # The vocabularies or the title list may have changed since.
+        self.analysis_cache.version = Analyzer.get_analysis_version()
+        if self.workers > 0:
+            self.pool = Analyzer.start_pool(self.workers)
+        try:
+            with profile(self.profile_path), metrics.time('run'):
+                # The comments of the next threads are fetched while the
+                # current one is checked. Some threads have theirs stored.
+                for submission in self.fetcher.prefetch_comments(
+                        self.get_unchecked_submissions(submissions),
+                        fetched):
+                    try:
+                        self.check_thread(submission)
+                    except SourceError as error:
+                        # Checked again on the next run.
+                        metrics.count('threads_failed')
+                        print('Skipping thread', submission.id, 'for now:',
+                              error)
+                        if oldest_failed is None or \
+                                submission.created < oldest_failed:
+                            oldest_failed = submission.created
+                        continue
+                    self.add_checked_submission(submission.id,
+                                                submission.created)
+        finally:
+            self.recipe_handler.flush()
+            self.old_submissions.flush()
+            self.analysis_cache.flush()
+            if self.pool is not None:
+                self.pool.shutdown()
+                self.pool = None
+            self.write_metrics()
+        print("Analysis cache:", self.analysis_cache)
+        return oldest_failed
+
+    def write_metrics(self):
+        """Writes the metrics file, if there is one."""
+
+        if self.metrics_path is not None:
+            metrics.write(self.metrics_path)
+
+    def get_unchecked_submissions(self, submissions=None):
         """
-        with open('../misc/submission_IDs.txt') as submissions_list:
-            for line in submissions_list.readlines():
-                line = line[:-1]
-                self.old_submission_ids.append(line)
+        Lists the submissions that are older than a day and were not checked
+        yet. Submissions older than the window of the seen store are left
+        out, since it would not remember having checked them.
 
-    def run_bot(self):
-        """Runs the script endlessly."""
+        :param submissions: The submissions to go through, the hot listing
+        if not given.
+        :return: A generator of submissions.
+        """
 
-        print("Working...")
-        submissions = self.get_submissions()
+        if submissions is None:
+            submissions = self.get_submissions()
+        oldest = self.old_submissions.get_oldest()
         for submission in submissions:
-            if submission.id not in self.old_submission_ids and \
-                    int(time()) - submission.created > DAY_SECONDS:
-                try:
-                    self.check_post(submission)
-                except AttributeError:
-                    pass
-                comments = self.get_comments(submission)
-                for comment in comments:
-                    try:
-                        self.check_post(comment)
-                    except AttributeError:
-                        pass
-                self.add_checked_submission(submission.id)
+            metrics.count('submissions_listed')
+            if submission.id not in self.old_submissions and \
+                    oldest <= submission.created < time() - DAY_SECONDS:
+                yield submission
+
+    def check_thread(self, submission):
+        """
+        Checks a submission and all of its comments for recipes, analyzing
+        the posts in the worker pool and storing the recipes found in the
+        order the posts were fetched.
+
+        Posts are checked a batch at a time, while the next comments are
+        fetched. Threads longer than a batch are stored as they come in,
+        and their progress is saved with every batch of recipes, so an
+        interrupted thread is carried on where it stopped. Their recipes are
+        typed from the posts stored so far, and retyped as more come in.
+
+        :param submission: The submission to check.
+        """
+
+        metrics.count('threads_checked')
+        db = self.recipe_handler.db
+        progress = db.get_thread_progress(submission.id)
+        type_counts = Counter()
+
+        if progress is None:
+            posts = self.iter_raw_posts(submission)
+            raw_posts = list(islice(posts, CHECKPOINT_SIZE + 1))
+            if len(raw_posts) <= CHECKPOINT_SIZE:
+                self.check_short_thread(raw_posts)
+                return
+            db.start_thread(submission.id)
+            position = fetched = 0
+            posts = chain(raw_posts, posts)
+        else:
+            position, _, complete = progress
+            fetched = db.count_thread_posts(submission.id)
+            count_types(db.iter_thread_texts(submission.id), type_counts)
+            recipe_type = Analyzer.pick_type(type_counts)
+            metrics.count('threads_resumed')
+            metrics.count('posts_skipped', position)
+            while position < fetched:
+                batch = db.get_thread_posts(submission.id, position,
+                                            CHECKPOINT_SIZE)
+                position = self.check_batch(submission.id, batch,
+                                            recipe_type, position)
+            if complete:
+                return
+            # The walk starts over, but only to get past the stored posts,
+            # wherever new comments turned up among them.
+            stored_ids = db.get_thread_post_ids(submission.id)
+            posts = (raw_post for raw_post in
+                     self.iter_raw_posts(submission)
+                     if raw_post.post_info.id not in stored_ids)
+
+        for batch in get_batches(posts, CHECKPOINT_SIZE):
+            db.add_thread_posts(submission.id, fetched, batch)
+            fetched += len(batch)
+            count_types((get_text(raw_post) for raw_post in batch),
+                        type_counts)
+            position = self.check_batch(submission.id, batch,
+                                        Analyzer.pick_type(type_counts),
+                                        position)
+        db.finish_thread(submission.id)
+
+    def check_short_thread(self, raw_posts):
+        """Checks all the posts of a thread in one go.
+
+        :param raw_posts: The RawPosts of the thread.
+        """
+
+        metrics.count('posts_checked', len(raw_posts))
+        recipe_type = None
+        for raw_post, refined_post in zip(raw_posts,
+                                          self.analyze(raw_posts)):
+            if refined_post is not None:
+                if recipe_type is None:
+                    recipe_type = self.get_type(
+                        get_text(post) for post in raw_posts)
+                refined_post.type = recipe_type
+                self.store_recipe(raw_post, refined_post)
+
+    def check_batch(self, submission_id, raw_posts, recipe_type, position):
+        """
+        Checks a batch of posts of a long thread, and stores the recipes
+        found together with the progress through the thread.
+
+        :param submission_id: The id of the thread's submission.
+        :param raw_posts: The RawPosts of the batch.
+        :param recipe_type: The type of the thread's recipes, going by the
+        posts stored so far. Recipes stored earlier are retyped if it
+        changed.
+        :param position: The position of the batch in the thread.
+        :return: The position of the next batch.
+        """
+
+        metrics.count('posts_checked', len(raw_posts))
+        for raw_post, refined_post in zip(raw_posts,
+                                          self.analyze(raw_posts)):
+            if refined_post is not None:
+                refined_post.type = recipe_type
+                self.store_recipe(raw_post, refined_post)
+        position += len(raw_posts)
+        self.recipe_handler.flush((submission_id, position, recipe_type))
+        return position
+
+    def iter_raw_posts(self, submission):
+        """
+        Hands out the posts of a thread as its comments are fetched, the
+        submission first.
+
+        :param submission: The submission of the thread.
+        :return: A generator of RawPosts, in the same order on every run.
+        """
+
+        posts = chain([submission], self.fetcher.iter_comments(submission))
+        for post in posts:
+            if post is not submission:
+                metrics.count('comments_fetched')
+            try:
+                yield self.get_raw_post(post, submission)
+            except AttributeError:
+                pass
+
+    def get_type(self, texts):
+        """Works out the type of a thread's recipes from all of its text.
+
+        :param texts: An iterable of the texts of the thread's posts.
+        :return: The recipe type.
+        """
+
+        return Analyzer.pick_type(count_types(texts))
+
+    def analyze(self, raw_posts):
+        """Analyzes posts with the bot's worker pool and analysis cache.
+
+        :param raw_posts: The RawPosts to analyze.
+        :return: A list of RefinedPosts or None, in the same order as the
+        posts.
+        """
+
+        return Analyzer.analyze_many(raw_posts, self.analysis_cache,
+                                     self.pool)
 
-    def get_submissions(self):
-        """Retrieves a set of new submissions that are older than 1 day."""
+    def get_submissions(self, listing=None):
+        """
+        Retrieves a set of new submissions that are older than 1 day. Getting
+        every next submission is timed as the listing stage, which is where
+        the listing's pages are fetched.
 
-        return self.subreddit.get_hot(limit=None)
+        :param listing: The listing to go through, the hot one if not given.
+        """
 
-    def get_comments(self, submission):
-        """Retrieves a set of comments pertaining to a submission.
+        if listing is None:
+            listing = self.source.get_submissions()
+        submissions = iter(listing)
+        while True:
+            with metrics.time('listing'):
+                submission = next(submissions, None)
+            if submission is None:
+                return
+            yield submission
 
-        :param submission: The submission to get the comments from.
+    def get_new_submissions(self, since, until):
+        """
+        Lists the submissions posted after one time and no later than
+        another, from the newest listing. The listing is only read up to the
+        first submission that is too old, so a poll costs as many requests
+        as there were new submissions since the last one.
+
+        :param since: The time the earliest submissions were posted after.
+        :param until: The time the latest submissions were posted at most.
+        :return: A generator of submissions, newest first.
         """
 
-        submission.replace_more_comments(limit=None, threshold=0)
-        all_comments = praw.helpers.flatten_tree(submission.comments)
-        return all_comments
+        for submission in self.get_submissions(self.source.get_new()):
+            if submission.created <= since:
+                return
+            if submission.created <= until:
+                yield submission
 
     def go_sleep(self, length_time):
         """Puts the program to sleep for a set amount of time.
@@ -94,80 +371,45 @@ class RedditAPI:
 
         return Analyzer.determine_if_recipe(content)
 
-    def check_post(self, post):
-        """Checks a post for qualities of a recipe.
+    def get_raw_post(self, post, submission):
+        """Copies the text and details of a post needed for analysis.
 
-        :param post: The post to get the comments from.
+        :param post: The submission or comment to copy.
+        :param submission: The submission the post belongs to.
+        :return: The RawPost.
         """
 
-        if isinstance(post, praw.objects.Submission):
+        if self.source.is_submission(post):
+            title = post.title
             content = post.selftext
             url = post.permalink
         else:  # Comment
+            title = ''
             content = post.body
-            submission_id = post.link_id[3:]
-            parent_post = self.reddit.get_submission(
-                submission_id=submission_id)
-            url = parent_post.permalink + post.id
+            url = submission.permalink + post.id
 
-        clean_content = Analyzer.clean_up(content)
+        post_info = PostInfo(post.author.name, post.score, post.created,
+                             post.id, url)
+        return RawPost(post_info, title, content)
 
-        if self.is_recipe(clean_content):
-            print("Got a recipe!! Mama mia! " + str(datetime.now()))
-            all_text = self.get_all_text(post)
+    def store_recipe(self, raw_post, refined_post):
+        """Hands a finished recipe over to the recipe handler.
 
-            author = post.author.name
-            karma = post.score
-            date_posted = post.created
-            post_id = post.id
-
-            title = Analyzer.determine_title(post)
-            ingredients = Analyzer.get_ingredients(content)
-            instructions = Analyzer.get_instructions(content)
-            recipe_type = Analyzer.determine_type(all_text)
+        :param raw_post: The RawPost the recipe was found in.
+        :param refined_post: The RefinedPost of the recipe.
+        """
 
-            post_info = PostInfo(author, karma, date_posted, post_id, url)
-            refined_post = RefinedPost(title, ingredients, instructions,
-                                       recipe_type)
-            recipe = Recipe(post_info, refined_post)
-            self.recipe_handler.add(recipe)
+        print("Got a recipe!! Mama mia! " + str(datetime.now()))
+        metrics.count('recipes_found')
+        recipe = Recipe(raw_post.post_info, refined_post)
+        self.recipe_handler.add(recipe)
 
-    def add_checked_submission(self, submission_id):
+    def add_checked_submission(self, submission_id, created=None):
         """
         Records a submission id when it was already scanned to prevent the
         bot from scanning it again.
 
         :param submission_id: The submission to record.
+        :param created: When the submission was posted, if known.
         """
-        self.old_submission_ids.append(submission_id)
-        with open('../misc/submission_IDs.txt', 'a') as submissions:
-            submissions.write(submission_id + '\n')
-
-    def get_all_text(self, post):
-        """
-        Obtain all the text of a submission, including its comments.
-        If a comment is passed, its parent submission will be determined.
-
-        :param post: The comment of submission to obtain the thread's text
-        from.
-        :return: A cleaned up version of all the text within the thread, ready
-        for further analysis.
-        """
-
-        all_text = ''
-
-        # Get the parent submission of a comment
-        if isinstance(post, praw.objects.Comment):
-            submission_id = post.link_id[3:]
-            post = self.reddit.get_submission(submission_id=submission_id)
-
-        submission_text = post.selftext
-        submission_title = post.title
-        ''.join((all_text, submission_title + '\n', submission_text + '\n'))
-        comments = self.get_comments(post)
-        for comment in comments:
-            ''.join((all_text, comment.body + '\n'))
-
-        clean_content = Analyzer.clean_up(all_text)
-
-        return clean_content
+        self.old_submissions.add(submission_id, created)
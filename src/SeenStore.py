@@ -0,0 +1,131 @@
+"""Remembers which submissions have already been scanned by the bot."""
+
+import os
+from time import time
+
+SEEN_WINDOW_SECONDS = 30 * 24 * 3600
+FLUSH_SIZE = 50
+LEGACY_FILE = '../misc/submission_IDs.txt'
+
+
+class SeenStore:
+    """
+    Set of scanned submission ids, kept in memory for constant time lookups
+    and persisted in the recipe database.
+
+    New ids are written in batches. Ids of submissions posted longer ago
+    than the window are dropped, and such submissions are not scanned
+    anymore, so a thread that stays listed for long is not scanned again
+    once its id is forgotten.
+    """
+
+    def __init__(self, db, window=SEEN_WINDOW_SECONDS, flush_size=FLUSH_SIZE,
+                 legacy_file=LEGACY_FILE, before_flush=None):
+        """
+        :param db: The Database to store the ids in.
+        :param window: How many seconds after a submission was posted its
+        id is remembered for.
+        :param flush_size: How many new ids are kept before writing them.
+        :param legacy_file: The old text file of ids to import once.
+        :param before_flush: Function called before ids are written, e.g.
+        to store the recipes found in those submissions first, so that no
+        submission is remembered as scanned while its recipes are lost.
+        """
+
+        self.connection = db.connection
+        self.cursor = self.connection.cursor()
+        self.window = window
+        self.flush_size = flush_size
+        self.pending = []
+        self.before_flush = before_flush
+        self.import_legacy_file(legacy_file)
+        self.expire()
+
+        sql = 'SELECT submission_id FROM SeenSubmissions'
+        self.ids = set(row[0] for row in self.cursor.execute(sql))
+
+    def import_legacy_file(self, path):
+        """
+        Moves the ids from the old submission_IDs.txt file into the database.
+        The file is renamed afterwards so it is only imported once.
+
+        :param path: The text file with one submission id per line.
+        """
+
+        if not os.path.exists(path):
+            return
+
+        with open(path) as submissions_list:
+            now = int(time())
+            rows = [(line.strip(), now) for line in submissions_list
+                    if line.strip()]
+
+        with self.connection:
+            self.cursor.executemany('INSERT OR IGNORE INTO SeenSubmissions '
+                                    'VALUES(?, ?)', rows)
+        os.replace(path, path + '.imported')
+        print('Imported', len(rows), 'submission ids from', path)
+
+    def get_oldest(self):
+        """Finds the earliest posting time of a submission still scanned.
+
+        :return: The timestamp the window starts at.
+        """
+
+        return int(time()) - self.window
+
+    def expire(self):
+        """
+        Forgets the ids of submissions posted before the window, along with
+        threads that were started that long ago and never finished.
+        """
+
+        oldest = self.get_oldest()
+        with self.connection:
+            self.cursor.execute('DELETE FROM SeenSubmissions WHERE time < ?',
+                                [oldest])
+            self.cursor.execute('DELETE FROM ThreadProgress WHERE time < ?',
+                                [oldest])
+            self.cursor.execute('DELETE FROM ThreadPosts WHERE submission_id '
+                                'NOT IN (SELECT submission_id '
+                                'FROM ThreadProgress)')
+
+    def __contains__(self, submission_id):
+        return submission_id in self.ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, submission_id, created=None):
+        """Records a scanned submission.
+
+        :param submission_id: The id of the submission.
+        :param created: When the submission was posted, now if not known.
+        """
+
+        self.ids.add(submission_id)
+        self.pending.append((submission_id, int(
+            created if created is not None else time())))
+        if len(self.pending) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes all the recorded ids that were not written yet, and drops
+        the progress of those threads, which is not needed anymore.
+        """
+
+        if not self.pending:
+            return
+
+        if self.before_flush is not None:
+            self.before_flush()
+        ids = [(submission_id,) for submission_id, _ in self.pending]
+        with self.connection:
+            self.cursor.executemany('INSERT OR REPLACE INTO SeenSubmissions '
+                                    'VALUES(?, ?)', self.pending)
+            self.cursor.executemany('DELETE FROM ThreadProgress '
+                                    'WHERE submission_id = ?', ids)
+            self.cursor.executemany('DELETE FROM ThreadPosts '
+                                    'WHERE submission_id = ?', ids)
+        self.pending = []
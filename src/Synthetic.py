@@ -0,0 +1,129 @@
+"""Synthetic posts for benchmarking the bot without touching Reddit."""
+
+import random
+from time import time
+from src.Analyzer import TITLES_PATH
+
+FOODS = ['rice', 'black beans', 'lentils', 'chicken thighs', 'oats',
+         'spinach', 'onion', 'garlic', 'canned tomatoes', 'eggs', 'potatoes',
+         'carrots', 'peanut butter', 'tofu', 'frozen peas', 'cabbage',
+         'chickpeas', 'pasta', 'ground turkey', 'bananas', 'yogurt',
+         'cheddar cheese', 'sweet potatoes', 'broccoli', 'tortillas']
+UNITS = ['cup', 'cups', 'tbsp', 'tsp', 'lb', 'oz', 'can', 'cloves', 'pinch']
+STEPS = ['Preheat the oven to 400F.', 'Chop the {0} and set aside.',
+         'Boil the {0} for 10 minutes.', 'Saute the {0} until soft.',
+         'Mix everything together with the {0}.', 'Season to taste.',
+         'Simmer for 20 minutes, stirring occasionally.',
+         'Serve with the {0} on top.', 'Let it cool before storing.']
+CHATTER = ['This is great for breakfast before work.',
+           'I make this every week for lunch and it costs about $2.',
+           'My family loves this for dinner.',
+           'Does anyone have a cheaper substitute for {0}?',
+           'Thanks for sharing, going to try this tonight!',
+           'I usually buy {0} in bulk from the store.',
+           'You can freeze leftovers for up to a month.',
+           'Honestly the trick is to add more {0}.']
+HEADERS = [('Ingredients', 'Instructions'), ('Ingredients:', 'Directions:'),
+           ('**Ingredients**', '**Method**'), ('Shopping list', 'Method')]
+
+
+def load_titles(path=TITLES_PATH):
+    """Loads the known recipe titles to sprinkle into synthetic posts.
+
+    :param path: The title list to read.
+    :return: A list of titles.
+    """
+
+    with open(path, encoding='latin-1') as titles:
+        return [line.rstrip('\n') for line in titles]
+
+
+def recipe_post(rng, titles, length=6):
+    """Builds the body of a post that contains a recipe.
+
+    :param rng: The random.Random instance to draw from.
+    :param titles: The recipe titles to pick a dish name from.
+    :param length: Roughly how many ingredient and instruction lines to use.
+    :return: A (title, body) tuple.
+    """
+
+    title = rng.choice(titles)
+    ingredients_header, instructions_header = rng.choice(HEADERS)
+    lines = [chatter(rng), 'Here is my {0}.'.format(title.lower()), '',
+             ingredients_header, '']
+    for _ in range(length):
+        lines.append('- {0} {1} {2}'.format(rng.randint(1, 4),
+                                            rng.choice(UNITS),
+                                            rng.choice(FOODS)))
+    lines.extend(['', instructions_header, ''])
+    for step_num in range(length):
+        lines.append('{0}. {1}'.format(step_num + 1, rng.choice(STEPS).format(
+            rng.choice(FOODS))))
+    return title, '\n'.join(lines)
+
+
+def chatter_post(rng, length=3):
+    """Builds the body of a post that does not contain a recipe.
+
+    :param rng: The random.Random instance to draw from.
+    :param length: How many sentences to use.
+    :return: The body of the post.
+    """
+
+    return ' '.join(chatter(rng) for _ in range(length))
+
+
+def chatter(rng):
+    """Builds a single sentence of small talk about food."""
+
+    return rng.choice(CHATTER).format(rng.choice(FOODS))
+
+
+def make_posts(count, recipe_share=0.3, seed=0, titles=None):
+    """Builds a fixed list of synthetic post bodies.
+
+    :param count: How many posts to build.
+    :param recipe_share: The fraction of posts that contain a recipe.
+    :param seed: The seed, so that every run uses the same posts.
+    :param titles: The recipe titles to use, loaded from disk if missing.
+    :return: A list of (title, body) tuples, with an empty title for posts
+    that are not recipes.
+    """
+
+    rng = random.Random(seed)
+    titles = titles if titles is not None else load_titles()
+    posts = []
+    for _ in range(count):
+        if rng.random() < recipe_share:
+            posts.append(recipe_post(rng, titles, rng.randint(3, 15)))
+        else:
+            posts.append(('', chatter_post(rng, rng.randint(1, 12))))
+    return posts
+
+
+def recipe_rows(count, seed=0, span=365 * 86400, authors=5000, newest=0):
+    """Builds rows for the Recipes table, spread over the past year.
+
+    Much cheaper than analyzing synthetic posts, for filling large test
+    databases.
+
+    :param count: How many rows to build.
+    :param seed: The seed, so that every run uses the same rows.
+    :param span: How many seconds back the posting times go.
+    :param authors: How many different authors to spread the rows over.
+    :param newest: How many seconds ago the newest row may be posted.
+    :return: A generator of row tuples in the column order of Recipes.
+    """
+
+    rng = random.Random(seed)
+    now = int(time())
+    for row_num in range(count):
+        ingredients = ';'.join('- ' + rng.choice(FOODS) for _ in range(6))
+        instructions = ';'.join('- ' + rng.choice(STEPS).format(
+            rng.choice(FOODS)) for _ in range(6))
+        post_id = 'p{0}'.format(row_num)
+        yield (post_id, 'user{0}'.format(rng.randrange(authors)),
+               rng.randint(0, 2000), 'https://reddit.com/' + post_id,
+               rng.choice(FOODS).title(), ingredients, instructions,
+               rng.choice(['Breakfast', 'Lunch', 'Dinner', 'All meals!']),
+               now - newest - rng.randrange(span))
@@ -0,0 +1,387 @@
+"""Inverted index over the known recipe titles.
+
+Scoring every title with fuzz.token_set_ratio is far too slow to do for each
+post, so the index narrows the title list down to a small shortlist of likely
+candidates first and only runs the fuzzy scorer on that shortlist.
+
+When NumPy and SciPy are installed, many posts can be shortlisted at once
+with sparse matrix products instead of walking the postings one post at a
+time.
+"""
+
+import heapq
+import os
+import pickle
+import re
+from fuzzywuzzy import fuzz
+
+# Imported on first use by load_sparse, so analyzing single posts does not
+# pay for importing them.
+numpy = None
+sparse = None
+
+NGRAM_SIZE = 3
+SHORTLIST_SIZE = 60
+BATCH_SIZE = 256
+
+# Bump whenever the layout of the index changes, so old caches are rebuilt.
+CACHE_VERSION = 1
+CACHE_MAGIC = b'ECAH-TITLES'
+
+# Mirrors the preprocessing fuzzywuzzy applies before token_set_ratio, so the
+# tokens in the index are exactly the tokens the scorer compares.
+_non_ascii = dict((i, None) for i in range(128, 256))
+_non_word = re.compile(r'(?ui)\W')
+
+
+def load_sparse():
+    """Imports NumPy and SciPy's sparse matrices, if they are installed.
+
+    :return: Whether both could be imported.
+    """
+
+    global numpy, sparse
+    if sparse is None:
+        try:
+            import numpy
+            from scipy import sparse
+        except ImportError:
+            return False
+    return True
+
+
+def tokenize(text):
+    """Splits a body of text into the tokens token_set_ratio works with.
+
+    :param text: The body of text to tokenize.
+    :return: A list of lower case tokens.
+    """
+
+    text = text.translate(_non_ascii)
+    return _non_word.sub(' ', text).lower().split()
+
+
+def get_ngrams(tokens):
+    """Builds the set of padded character n-grams for a set of tokens.
+
+    :param tokens: The tokens to split into n-grams.
+    :return: A set of n-gram strings.
+    """
+
+    ngrams = set()
+    for token in tokens:
+        padded = ' ' + token + ' '
+        for start in range(max(len(padded) - NGRAM_SIZE + 1, 1)):
+            ngrams.add(padded[start:start + NGRAM_SIZE])
+    return ngrams
+
+
+def load_title_index(path, cache_path):
+    """Loads the index of a title list, preferring the binary cache.
+
+    The cache is rebuilt when it is missing, was written by another version
+    of the index, or when the title list changed since it was written.
+
+    :param path: The title list, one title per line.
+    :param cache_path: Where the preprocessed index is cached.
+    :return: The TitleIndex.
+    """
+
+    header = get_cache_header(path)
+
+    try:
+        with open(cache_path, 'rb') as cache:
+            data = cache.read()
+        if data.startswith(header):
+            return pickle.loads(data[len(header):])
+    except (OSError, pickle.UnpicklingError, EOFError):
+        pass
+
+    with open(path, encoding='latin-1') as titles:
+        title_index = TitleIndex(line.rstrip('\n') for line in titles)
+
+    try:
+        temp_path = cache_path + '.tmp'
+        with open(temp_path, 'wb') as cache:
+            cache.write(header)
+            pickle.dump(title_index, cache, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, cache_path)
+    except OSError as error:
+        print('Could not cache the title index:', error)
+
+    return title_index
+
+
+def get_cache_header(path):
+    """
+    Builds the header identifying a cache of a title list, made of the cache
+    version and the size and modification time of the list.
+
+    :param path: The title list.
+    :return: The header as bytes.
+    """
+
+    stat = os.stat(path)
+    return CACHE_MAGIC + '-{0}-{1}-{2}-{3}\n'.format(
+        CACHE_VERSION, NGRAM_SIZE, stat.st_size, stat.st_mtime_ns).encode()
+
+
+class TitleIndex:
+    """Token and character n-gram index over a list of recipe titles."""
+
+    def __init__(self, titles):
+        """
+        :param titles: The recipe titles to index, in order of preference
+        when two titles score the same.
+        """
+
+        self.titles = list(titles)
+        self.title_tokens = []
+        self.title_ngram_counts = []
+        self.token_postings = {}
+        self.ngram_postings = {}
+        self.matrices = None
+
+        for title_num, title in enumerate(self.titles):
+            tokens = frozenset(tokenize(title))
+            ngrams = get_ngrams(tokens)
+            self.title_tokens.append(tokens)
+            self.title_ngram_counts.append(len(ngrams))
+            for token in tokens:
+                self.token_postings.setdefault(token, []).append(title_num)
+            for ngram in ngrams:
+                self.ngram_postings.setdefault(ngram, []).append(title_num)
+
+    def __getstate__(self):
+        # The batch matrices are rebuilt on demand rather than cached.
+        state = self.__dict__.copy()
+        state['matrices'] = None
+        return state
+
+    def top_titles(self, text, limit=1):
+        """Finds the titles that best describe a body of text.
+
+        Titles whose tokens are all contained in the text (or that contain
+        every token of the text) always score 100 with token_set_ratio, so
+        those are returned without scoring. Otherwise only a shortlist of
+        titles sharing tokens or n-grams with the text is scored.
+
+        :param text: The body of text to find a title for.
+        :param limit: The number of titles to return.
+        :return: A list of (title, score) tuples, best match first.
+        """
+
+        text_tokens = set(tokenize(text))
+
+        token_hits = {}
+        for token in text_tokens:
+            for title_num in self.token_postings.get(token, ()):
+                token_hits[title_num] = token_hits.get(title_num, 0) + 1
+
+        perfect = sorted(
+            title_num for title_num, hits in token_hits.items()
+            if hits == len(self.title_tokens[title_num]) or
+            hits == len(text_tokens))
+        if len(perfect) >= limit:
+            return self.score_shortlist(text, perfect, [], limit)
+
+        shortlist = self.get_shortlist(text_tokens, token_hits,
+                                       exclude=set(perfect))
+        return self.score_shortlist(text, perfect, shortlist, limit)
+
+    def top_titles_batch(self, texts, limit=1):
+        """Finds the titles that best describe each of many bodies of text.
+
+        Gives the same kind of result as calling top_titles on every text,
+        but shortlists a whole batch of texts with sparse matrix products.
+        Falls back to top_titles when NumPy or SciPy are not installed.
+
+        :param texts: The bodies of text to find titles for.
+        :param limit: The number of titles to return for each text.
+        :return: A list holding a list of (title, score) tuples per text.
+        """
+
+        if not load_sparse():
+            return [self.top_titles(text, limit) for text in texts]
+
+        if self.matrices is None:
+            self.matrices = self.build_matrices()
+
+        results = []
+        for start in range(0, len(texts), BATCH_SIZE):
+            results.extend(self.match_batch(texts[start:start + BATCH_SIZE],
+                                            limit))
+        return results
+
+    def build_matrices(self):
+        """Builds the sparse title matrices used for batch matching.
+
+        :return: A dict holding the token and n-gram column numbers, the
+        transposed binary title matrices and the per title sizes.
+        """
+
+        matrices = {}
+        for kind, postings in (('token', self.token_postings),
+                               ('ngram', self.ngram_postings)):
+            columns = {}
+            rows = []
+            title_nums = []
+            for column, (key, posting) in enumerate(postings.items()):
+                columns[key] = column
+                rows.extend([column] * len(posting))
+                title_nums.extend(posting)
+            matrices[kind + '_columns'] = columns
+            matrices[kind + '_matrix'] = sparse.csr_matrix(
+                (numpy.ones(len(rows), dtype=numpy.int32),
+                 (rows, title_nums)),
+                shape=(len(columns), len(self.titles)))
+
+        matrices['token_counts'] = numpy.array(
+            [len(tokens) for tokens in self.title_tokens], dtype=numpy.int32)
+        matrices['ngram_counts'] = numpy.maximum(
+            numpy.array(self.title_ngram_counts, dtype=numpy.float64), 1)
+        return matrices
+
+    def vectorize(self, features, columns):
+        """Builds a binary sparse matrix with one row per set of features.
+
+        :param features: A list of feature sets, one per text.
+        :param columns: Mapping of feature to column number.
+        :return: The sparse matrix.
+        """
+
+        rows = []
+        cols = []
+        for row, feature_set in enumerate(features):
+            for feature in feature_set:
+                column = columns.get(feature)
+                if column is not None:
+                    rows.append(row)
+                    cols.append(column)
+        return sparse.csr_matrix(
+            (numpy.ones(len(rows), dtype=numpy.int32), (rows, cols)),
+            shape=(len(features), len(columns)))
+
+    def match_batch(self, texts, limit):
+        """Finds the best titles for one batch of texts.
+
+        :param texts: The bodies of text to find titles for.
+        :param limit: The number of titles to return for each text.
+        :return: A list holding a list of (title, score) tuples per text.
+        """
+
+        matrices = self.matrices
+        text_tokens = [set(tokenize(text)) for text in texts]
+        token_hits = self.vectorize(
+            text_tokens, matrices['token_columns']).dot(
+            matrices['token_matrix']).tocsr()
+        ngram_hits = self.vectorize(
+            [get_ngrams(tokens) for tokens in text_tokens],
+            matrices['ngram_columns']).dot(matrices['ngram_matrix']).tocsr()
+
+        results = []
+        for row, text in enumerate(texts):
+            hit_span = slice(token_hits.indptr[row],
+                             token_hits.indptr[row + 1])
+            hit_titles = token_hits.indices[hit_span]
+            hit_counts = token_hits.data[hit_span]
+            title_sizes = matrices['token_counts'][hit_titles]
+            is_perfect = ((hit_counts == title_sizes) |
+                          (hit_counts == len(text_tokens[row])))
+            perfect = sorted(hit_titles[is_perfect].tolist())
+            if len(perfect) >= limit:
+                results.append(self.score_shortlist(text, perfect, [], limit))
+                continue
+
+            token_share = numpy.zeros(len(self.titles))
+            token_share[hit_titles] = hit_counts / title_sizes
+            token_share[hit_titles[is_perfect]] = -1
+
+            ngram_span = slice(ngram_hits.indptr[row],
+                               ngram_hits.indptr[row + 1])
+            candidates = ngram_hits.indices[ngram_span]
+            # Same ordering as get_shortlist: token share first, with the
+            # n-gram share (at most 1) only breaking ties.
+            closeness = (token_share[candidates] * 1000 +
+                         ngram_hits.data[ngram_span] /
+                         matrices['ngram_counts'][candidates])
+            keep = token_share[candidates] >= 0
+            candidates = candidates[keep]
+            closeness = closeness[keep]
+            if len(candidates) > SHORTLIST_SIZE:
+                best = numpy.argpartition(-closeness, SHORTLIST_SIZE)
+                candidates = candidates[best[:SHORTLIST_SIZE]]
+            results.append(self.score_shortlist(text, perfect,
+                                                candidates.tolist(), limit))
+
+        return results
+
+    def score_shortlist(self, text, perfect, shortlist, limit):
+        """Scores a shortlist of titles and picks the best ones.
+
+        :param text: The body of text to find a title for.
+        :param perfect: Title numbers already known to score 100, in order.
+        :param shortlist: Title numbers that still need to be scored.
+        :param limit: The number of titles to return.
+        :return: A list of (title, score) tuples, best match first.
+        """
+
+        results = [(self.titles[title_num], 100)
+                   for title_num in perfect[:limit]]
+        if len(results) == limit:
+            return results
+        if not shortlist and not results:
+            return self.scan(text, limit)
+
+        scored = [(fuzz.token_set_ratio(self.titles[title_num], text),
+                   title_num) for title_num in shortlist]
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        for score, title_num in scored[:limit - len(results)]:
+            results.append((self.titles[title_num], score))
+
+        return results
+
+    def get_shortlist(self, text_tokens, token_hits, exclude=()):
+        """Picks the titles most likely to score well against a text.
+
+        Titles are ranked by the share of their tokens found in the text, then
+        by the share of their character n-grams found in the text, which
+        catches misspellings and plurals.
+
+        :param text_tokens: The set of tokens within the text.
+        :param token_hits: Mapping of title number to the amount of its
+        tokens found in the text.
+        :param exclude: Title numbers that should not be shortlisted.
+        :return: A list of title numbers.
+        """
+
+        ngram_hits = {}
+        for ngram in get_ngrams(text_tokens):
+            for title_num in self.ngram_postings.get(ngram, ()):
+                ngram_hits[title_num] = ngram_hits.get(title_num, 0) + 1
+
+        def closeness(title_num):
+            return (token_hits.get(title_num, 0) /
+                    len(self.title_tokens[title_num]),
+                    ngram_hits[title_num] /
+                    self.title_ngram_counts[title_num])
+
+        candidates = (title_num for title_num in ngram_hits
+                      if title_num not in exclude)
+        return heapq.nlargest(SHORTLIST_SIZE, candidates, key=closeness)
+
+    def scan(self, text, limit=1):
+        """Scores every title against a body of text.
+
+        This is the exhaustive reference the shortlist is measured against.
+
+        :param text: The body of text to find a title for.
+        :param limit: The number of titles to return.
+        :return: A list of (title, score) tuples, best match first.
+        """
+
+        scored = [(fuzz.token_set_ratio(title, text), title_num)
+                  for title_num, title in enumerate(self.titles)]
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [(self.titles[title_num], score)
+                for score, title_num in scored[:limit]]